@@ -1,8 +1,9 @@
 import osmnx as ox
 import matplotlib.pyplot as plt
+from graph_store import load_graph
 
 # Load map for Porto
-G = ox.graph_from_place("Porto, Portugal", network_type="drive", which_result=2)
+G = load_graph()
 
 # Plot map without points and without zooming in
 fig, ax = ox.plot_graph(G, show=False, close=False, figsize=(10, 10), bgcolor="white",
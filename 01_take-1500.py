@@ -1,38 +1,107 @@
 import csv
+import random
 import numpy as np
 import matplotlib.pyplot as plt
 from datetime import datetime
+from zoneinfo import ZoneInfo
+from polylines import decode_polylines, drop_consecutive_duplicates, encode_polyline, take_lists
+from trip_store import build_trip_store, write_trips
 
 # Input and output file paths
 input_file = './data/train.csv'
 output_file = './data/train-1500.csv'
+output_store = './data/train-1500.parquet'
+full_corpus_store = None  # e.g. './data/train.parquet' to also store every trip of train.csv, e.g. for 06
 output_graph_file = './data/points_distribution.png'
 
-# Dictionary to store trip data
+# Subset selection parameters
+trip_limit = 1500
+selection_mode = 'first'  # 'first', 'reservoir' or 'window'
+window_start = None  # e.g. datetime(2013, 7, 1), only used by 'window'
+window_end = None  # e.g. datetime(2013, 7, 2), only used by 'window'
+window_time_zone = ZoneInfo('Europe/Lisbon')  # of window_start / window_end without a tzinfo
+random_seed = 42  # only used by 'reservoir'
+scan_full_input = False  # True reads the whole input for the 'before' statistics, False stops once the subset is complete
+
+# Dictionary to store the rows of the selected trips only
 trips = {}
-trip_ids_in_order = []
+# A trip is a run of consecutive rows with the same TRIP_ID, so trips are counted in constant
+# memory. The count is exact as long as the rows of a trip are consecutive, as in train.csv;
+# a TRIP_ID that reappears after other trips counts again.
+trips_before = 0
+previous_trip_id = None
 taxi_ids_before = set()
+rows_seen = 0
+trips_seen = 0
+reservoir = []
+rng = random.Random(random_seed)
+
+# Unix timestamp of a window bound, naive datetimes are taken in window_time_zone
+def window_timestamp(bound):
+    if bound is None:
+        return None
+    if bound.tzinfo is None:
+        bound = bound.replace(tzinfo=window_time_zone)
+    return int(bound.timestamp())
+
+window_start_ts = window_timestamp(window_start)
+window_end_ts = window_timestamp(window_end)
 
-# Step 1: Read the input file and store trip data
+# Step 1: Stream the input file and keep only the rows of the selected trips
 with open(input_file, 'r') as csvfile:
     reader = csv.DictReader(csvfile)
     for row in reader:
         trip_id = row['TRIP_ID']
         timestamp = int(row['TIMESTAMP'])
         taxi_id = row['TAXI_ID']
+        new_trip = trip_id != previous_trip_id
+        previous_trip_id = trip_id
+        trips_before += new_trip
         taxi_ids_before.add(taxi_id)
+        rows_seen += 1
 
-        # If trip is already in trips dictionary, append the entry
+        # If trip is already selected, append the entry
         if trip_id in trips:
             trips[trip_id].append(row)
+            continue
+        # Further rows of a trip that was not selected
+        if not new_trip:
+            continue
+
+        if selection_mode == 'first':
+            if len(trips) < trip_limit:
+                trips[trip_id] = [row]
+            elif not scan_full_input:
+                break
+        elif selection_mode == 'window':
+            if window_start_ts is not None and timestamp < window_start_ts:
+                continue
+            if window_end_ts is not None and timestamp >= window_end_ts:
+                continue
+            if len(trips) < trip_limit:
+                trips[trip_id] = [row]
+            elif not scan_full_input:
+                break
+        elif selection_mode == 'reservoir':
+            # Algorithm R over distinct trips, the reservoir is bounded by trip_limit
+            trips_seen += 1
+            if len(trips) < trip_limit:
+                trips[trip_id] = [row]
+                reservoir.append(trip_id)
+            else:
+                j = rng.randrange(trips_seen)
+                if j < trip_limit:
+                    del trips[reservoir[j]]
+                    reservoir[j] = trip_id
+                    trips[trip_id] = [row]
         else:
-            # Add a new trip with a list containing the current entry
-            trips[trip_id] = [row]
-            trip_ids_in_order.append((trip_id, timestamp))
+            raise ValueError(f"Unknown selection mode: {selection_mode}")
 
-# Step 2: Sort trips by timestamp and select the first 1500 unique trips
-# trip_ids_in_order.sort(key=lambda x: x[1])  # Sort by timestamp if needed
-selected_trip_ids = [trip_id for trip_id, _ in trip_ids_in_order[:1500]]
+# Step 2: Keep the trips in input order ('reservoir' and 'window' sort by timestamp)
+if selection_mode == 'first':
+    selected_trip_ids = list(trips)
+else:
+    selected_trip_ids = sorted(trips, key=lambda t: int(trips[t][0]['TIMESTAMP']))
 
 # Statistics to gather
 single_point_polylines = 0
@@ -41,18 +110,14 @@ total_points = 0
 valid_linestrings = 0
 points_per_trip = []
 taxi_ids_after = set()
+written_rows = []
+
+# Step 3: Decode the selected polylines in bulk and remove consecutive duplicates
+selected_rows = [row for trip_id in selected_trip_ids for row in trips[trip_id]]  # Order preserved
+coords, offsets = decode_polylines([row['POLYLINE'] for row in selected_rows])
+coords, offsets = drop_consecutive_duplicates(coords, offsets)
 
-# Helper function to filter duplicates in a polyline
-def filter_duplicate_points(polyline):
-    if len(polyline) < 2:
-        return polyline
-    filtered_polyline = [polyline[0]]
-    for point in polyline[1:]:
-        if point != filtered_polyline[-1]:  # Add only if different from last added point
-            filtered_polyline.append(point)
-    return filtered_polyline
-
-# Step 3: Write the selected trips to the output file and gather statistics
+# Step 4: Write the selected trips to the output file and gather statistics
 with open(output_file, 'w', newline='') as csvfile:
     fieldnames = ['TRIP_ID', 'CALL_TYPE', 'ORIGIN_CALL', 'ORIGIN_STAND', 'TAXI_ID', 
                   'TIMESTAMP', 'DAY_TYPE', 'MISSING_DATA', 'POLYLINE']
@@ -60,27 +125,34 @@ with open(output_file, 'w', newline='') as csvfile:
     writer.writeheader()
     
     # Write each selected trip with all its entries, excluding single-point trips
-    for trip_id in selected_trip_ids:  # Order preserved
-        for row in trips[trip_id]:
-            polyline = eval(row['POLYLINE'])  # Convert POLYLINE from string to list
-            polyline = filter_duplicate_points(polyline)  # Remove consecutive duplicates
-            num_points = len(polyline)
-            
-            # Exclude trips with only one point or empty polylines
-            if num_points <= 1:
-                single_point_polylines += 1
-                continue
+    for i, (row, start, end) in enumerate(zip(selected_rows, offsets[:-1], offsets[1:])):
+        num_points = int(end - start)
+        
+        # Exclude trips with only one point or empty polylines
+        if num_points <= 1:
+            single_point_polylines += 1
+            continue
+
+        # Write the row to the file
+        row['POLYLINE'] = encode_polyline(coords[start:end])  # Convert back to string for writing
+        writer.writerow(row)
+        written_rows.append(i)
+
+        # Track statistics
+        valid_linestrings += 1
+        total_points += num_points
+        points_per_trip.append(num_points)
+        max_points = max(max_points, num_points)
+        taxi_ids_after.add(row['TAXI_ID'])
 
-            # Write the row to the file
-            row['POLYLINE'] = str(polyline)  # Convert back to string for writing
-            writer.writerow(row)
+# Write the same trips to the columnar trip store read by the Python 3 stages, the CSV
+# above is only kept for the fmm Docker image (Python 2, no pyarrow) of stage 03
+written_coords, written_offsets = take_lists(coords, offsets, written_rows)
+write_trips(output_store, [selected_rows[i] for i in written_rows], written_coords, written_offsets)
 
-            # Track statistics
-            valid_linestrings += 1
-            total_points += num_points
-            points_per_trip.append(num_points)
-            max_points = max(max_points, num_points)
-            taxi_ids_after.add(row['TAXI_ID'])
+# Optionally stream the whole input into a trip store
+if full_corpus_store is not None:
+    build_trip_store(input_file, full_corpus_store)
 
 # Calculate additional statistics
 average_points = total_points / valid_linestrings if valid_linestrings > 0 else 0
@@ -98,10 +170,12 @@ plt.tight_layout()  # Adjust layout to fit labels within plot borders
 plt.savefig(output_graph_file)
 plt.close()
 
-# Display results
-print({
-    "Number of Trips Before Subsetting": len(trip_ids_in_order),
-    "Number of Unique Taxi IDs Before Subsetting": len(taxi_ids_before),
+# Display results, the 'before' numbers are only known after reading the whole input
+results = {"Rows Read": rows_seen}
+if scan_full_input or selection_mode == 'reservoir':
+    results["Number of Trips Before Subsetting"] = trips_before
+    results["Number of Unique Taxi IDs Before Subsetting"] = len(taxi_ids_before)
+results.update({
     "Number of Trips After Subsetting": len(selected_trip_ids),
     "Number of Unique Taxi IDs After Subsetting": len(taxi_ids_after),
     "Single Point Trips Removed": single_point_polylines,
@@ -111,3 +185,4 @@ print({
     "Average Number of Points": average_points,
     "Standard Deviation of Points": std_dev_points
 })
+print(results)
@@ -1,45 +1,21 @@
 import folium
-import pandas as pd
-import ast
+from folium_render import add_trips, map_bounds, save_map, trip_map
+from polylines import split_lists
+from trip_store import read_trips
 
-# Load data
-df = pd.read_csv('./data/train-1500.csv')
-
-# Identify and store first 15 TRIP_IDs based on the earliest TIMESTAMP
-selected_trip_ids = df["TRIP_ID"].unique()[:15]
-
-# Filter the data for these TRIP_IDs
-trip_data = df[df['TRIP_ID'].isin(selected_trip_ids)]
+# Read only the first 15 trips of the trip store
+_, coords, offsets = read_trips('./data/train-1500.parquet', columns=['TRIP_ID', 'POLYLINE'], limit=15)
 
 # Extract coordinates
-trip_coords = [ast.literal_eval(polyline) for polyline in trip_data['POLYLINE']]
-
-# Bounding box for map view
-all_points = [point for trip in trip_coords for point in trip]
-lons, lats = zip(*all_points)
-
-# Set map boundaries with margin (consistent with Code 2)
-margin = 0.005
-lon_min, lon_max = min(lons) - margin, max(lons) + margin
-lat_min, lat_max = min(lats) - margin, max(lats) + margin
-
-# Calculate center for consistent centering across both codes
-center_lat = (lat_min + lat_max) / 2
-center_lon = (lon_min + lon_max) / 2
+trip_coords = split_lists(coords, offsets)
 
-# Initialize map and set bounds
-fmap = folium.Map(location=[center_lat, center_lon], zoom_start=13, width=1500, height=1000)
-fmap.fit_bounds([[lat_min, lon_min], [lat_max, lon_max]])
-# Plot trips with unique colors
+# Initialize map with the bounding box of all trips as view
+fmap = trip_map(map_bounds(coords))
+# Plot trips with unique colors, one GeoJSON layer per trip
 colors = ['blue', 'green', 'red', 'purple', 'orange', 'darkred', 'lightred', 'beige', 'darkblue', 'darkgreen']
-for idx, coords in enumerate(trip_coords):
-    color = colors[idx % len(colors)]
-    feature_group = folium.FeatureGroup(name=f'Trip {idx + 1}')
-    [folium.CircleMarker(location=(lat, lon), radius=3, color=color, fill=True, fill_opacity=1).add_to(feature_group) for lon, lat in coords]
-    folium.PolyLine([(lat, lon) for lon, lat in coords], color=color, weight=2).add_to(feature_group)
-    fmap.add_child(feature_group)
+add_trips(fmap, trip_coords, [colors[idx % len(colors)] for idx in range(len(trip_coords))],
+          [f'Trip {idx + 1}' for idx in range(len(trip_coords))])
 
 # Layer control and save map
 fmap.add_child(folium.LayerControl())
-fmap.save('./data/porto_trips_map_zoomed.html')
-print("Map saved as ./data/porto_trips_map_zoomed.html")
+save_map(fmap, './data/porto_trips_map_zoomed.html')
@@ -1,17 +1,16 @@
 import osmnx as ox
 import matplotlib.pyplot as plt
-import ast
+from graph_store import load_graph
+from polylines import split_lists
+from trip_store import read_trips
 import random
-import pandas as pd
 
 # Load map and data
-G = ox.graph_from_place("Porto, Portugal", network_type="drive", which_result=2)
-df = pd.read_csv("./data/train-1500.csv")
+G = load_graph()
 
 # Select and process the first 15 trips
-trip_data = df[df["TRIP_ID"].isin(df["TRIP_ID"].unique()[:15])]
-all_points = [point for polyline in trip_data["POLYLINE"] for point in ast.literal_eval(polyline)]
-lons, lats = zip(*all_points)
+_, coords, offsets = read_trips("./data/train-1500.parquet", columns=["TRIP_ID", "POLYLINE"], limit=15)
+lons, lats = coords[:, 0], coords[:, 1]
 
 # Set map boundaries with margin
 margin = 0.005
@@ -29,11 +28,9 @@ ax.set_xlim(lon_min, lon_max)
 ax.set_ylim(lat_min, lat_max)
 
 # Plot GPS points for each trip with random colors
-for _, group in trip_data.groupby("TRIP_ID"):
-    points = [ast.literal_eval(row["POLYLINE"]) for _, row in group.iterrows()]
-    for path in points:
-        lons, lats = zip(*path)
-        ax.plot(lons, lats, marker="o", markersize=2, color=[random.random() for _ in range(3)], linewidth=1.5)
+for path in split_lists(coords, offsets):
+    lons, lats = path[:, 0], path[:, 1]
+    ax.plot(lons, lats, marker="o", markersize=2, color=[random.random() for _ in range(3)], linewidth=1.5)
 
 # Customize and save plot
 plt.title("First 15 Trips in Porto")
@@ -0,0 +1,31 @@
+import os
+import time
+from basemap import prefetch_tiles
+from static_render import plan_view, render_trips, view_bbox
+from trip_store import read_trips
+
+# Load the trip ids, timestamps and points
+df, coords, offsets = read_trips('./data/train-1500.parquet', columns=['TRIP_ID', 'TIMESTAMP', 'POLYLINE'])
+
+# Identify the first 100 TRIP_IDs based on the earliest TIMESTAMP
+selected_trip_ids = df.groupby("TRIP_ID").first().sort_values("TIMESTAMP").head(100).index
+trip_ids = df['TRIP_ID'][df['TRIP_ID'].isin(selected_trip_ids)]
+
+# Slice coordinates of these trips out of the ragged points
+trip_coords = [(trip_id, coords[offsets[row]:offsets[row + 1]]) for row, trip_id in trip_ids.items()]
+colors = ['blue', 'green', 'red', 'purple', 'orange', 'darkred', 'lightred', 'beige', 'darkblue', 'darkgreen']
+
+# Plan the view of every trip and download all of their tiles up front
+size = (1500, 1000)
+views = [plan_view(coords, size=size) for _, coords in trip_coords]
+prefetch_tiles([(view_bbox(view, size), view[0]) for view in views])
+
+# Render a separate image for each trip straight from the tiles, same views as the folium maps
+output_image_dir = './data/trip_images/'
+os.makedirs(output_image_dir, exist_ok=True)
+start_time = time.perf_counter()
+for idx, ((trip_id, coords), view) in enumerate(zip(trip_coords, views)):
+    render_trips(os.path.join(output_image_dir, f'porto_trip_{trip_id}.png'), [coords], [colors[idx % len(colors)]],
+                 size=size, view=view)
+elapsed = time.perf_counter() - start_time
+print(f"Rendered {len(trip_coords)} images to {output_image_dir} in {elapsed:.1f} s ({len(trip_coords) / elapsed * 60:.0f} images/min)")
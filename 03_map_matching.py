@@ -1,109 +1,79 @@
 import os
-import csv
-from fmm import FastMapMatch, Network, NetworkGraph, UBODTGenAlgorithm, UBODT, FastMapMatchConfig
+import json
+import multiprocessing
+from fmm import Network, NetworkGraph, UBODT
+from fmm_session import MatcherSession, cached_ubodt
+from matched_store import match_record, run_matching
 
 # Define paths and parameters
 network_file = "./porto/edges.shp"
-ubodt_file = "./data/ubodt.txt"
+ubodt_cache_dir = "./data/ubodt_cache"
 input_file = "./data/train-1500.csv"
-output_file = "./data/matched.csv"
+output_dir = "./data/matched_store"
+checkpoint_file = "./data/matched_store.checkpoint"
 trip_limit = 1500  # Limit processing to first 15 trips
 
 # Map matching parameters
 search_radius = 0.05
 k_neighbors = 10
 gps_accuracy = 0.005
-ubodt_distance_threshold = 0.02
-regen_ubodt = False
+ubodt_distance_threshold = 0.02  # Part of the UBODT cache key, changing it regenerates the table
 
-# Load or generate the network
-if not os.path.exists(network_file):
-    print("Network file {} does not exist.".format(network_file))
-else:
+# Parallelism, num_workers = 1 matches in the main process
+num_workers = multiprocessing.cpu_count()
+batch_size = 8  # Trips handed to a worker at a time
+
+# Resuming, with resume = True trips recorded in checkpoint_file are skipped and
+# output_dir is appended to instead of being overwritten
+resume = True
+checkpoint_interval = 256  # Trips per durable commit of output and checkpoint
+
+# Matcher session of this process, built once per worker by load_session
+session = None
+
+def load_session(ubodt_file):
+    global session
     network = Network(network_file, "fid", "u", "v")
-    print("Loaded network with {} nodes and {} edges.".format(network.get_node_count(), network.get_edge_count()))
     graph = NetworkGraph(network)
-    
-    # Generate UBODT if missing or flagged for regeneration
-    if not os.path.exists(ubodt_file) or regen_ubodt:
-        print("Generating UBODT file.")
-        ubodt_gen = UBODTGenAlgorithm(network, graph)
-        ubodt_gen.generate_ubodt(ubodt_file, ubodt_distance_threshold, binary=False, use_omp=True)
-    
-    # Load UBODT file
-    ubodt = UBODT.read_ubodt_csv(ubodt_file)
-    
-    print("Starting map matching process.")
-    with open(input_file, "r") as csv_input, open(output_file, "w") as csv_output:
-        print("Opened input and output files.")
-        csv_reader = csv.reader(csv_input)
-        csv_writer = csv.writer(csv_output)
-        
-        headers = next(csv_reader)
-        trip_id_index = headers.index("TRIP_ID")
-        polyline_index = headers.index("POLYLINE")
-        
-        # Write header for output
-        csv_writer.writerow(["idx", 
-                             "id",
-                             "match_path",
-                             "match_edge_by_pt",
-                             "match_edge_by_idx",
-                             "match_geom",
-                             "edge_id",
-                             "source",
-                             "target",
-                             "error",
-                             "length",
-                             "offset",
-                             "spdist",
-                             "ep",
-                             "tp",
-                             ])
+    ubodt = UBODT.read_ubodt_binary(ubodt_file)
+    session = MatcherSession(network, graph, ubodt, k_neighbors, search_radius, gps_accuracy)
+
+def match_batch(batch):
+    trips, trajectories = [], []
+    for row_index, trip_id, polyline in batch:
+        try:
+            trajectories.append(json.loads(polyline))
+            trips.append((row_index, trip_id))
+        except ValueError as e:
+            print("Error processing row {}: {}".format(row_index, e))
+
+    errors = []
+    match_results = session.match_many(trajectories, errors)
+    for i, e in errors:
+        print("Error processing row {}: {}".format(trips[i][0], e))
 
-        
-        
-        print("Processing rows for map matching.")
-        for row_index, row in enumerate(csv_reader):
-            if trip_limit is not None and row_index >= trip_limit:
-                print("Limit of {} trips reached.".format(trip_limit))
-                break
-            try:
-                trip_id = row[trip_id_index]
-                trajectory = eval(row[polyline_index])
-                
-                # Convert trajectory to WKT format
-                wkt_path = 'LINESTRING(' + ','.join([' '.join(map(str, point)) for point in trajectory]) + ')'
-                
-                # Initialize map-matching model and configuration
-                map_matcher = FastMapMatch(network, graph, ubodt)
-                map_matcher_config = FastMapMatchConfig(k_neighbors, search_radius, gps_accuracy)
+    # Only trips with a record are committed as done, so a resumed run retries the failed ones
+    done_trip_ids, records = [], []
+    for (row_index, trip_id), match_result in zip(trips, match_results):
+        if match_result is not None:
+            done_trip_ids.append(trip_id)
+            records.append(match_record(row_index, trip_id, match_result))
+    return done_trip_ids, records
 
-                # Perform map matching
-                print("Matching trip {}.".format(trip_id))
-                match_result = map_matcher.match_wkt(wkt_path, map_matcher_config)
-                print("Matched trip {}.".format(trip_id))
+if __name__ == "__main__":
+    # Load or generate the network
+    if not os.path.exists(network_file):
+        print("Network file {} does not exist.".format(network_file))
+    else:
+        network = Network(network_file, "fid", "u", "v")
+        print("Loaded network with {} nodes and {} edges.".format(network.get_node_count(), network.get_edge_count()))
+        graph = NetworkGraph(network)
 
-                # Write matched result
-                csv_writer.writerow([row_index, 
-                                    trip_id,
-                                    match_result.cpath,
-                                    match_result.opath,
-                                    match_result.indices,
-                                    match_result.mgeom.export_wkt(),
-                                    match_result.pgeom.export_wkt(),
-                                    [c.edge_id for c in match_result.candidates],
-                                    [c.source for c in match_result.candidates],
-                                    [c.target for c in match_result.candidates],
-                                    [c.error for c in match_result.candidates],
-                                    [c.length for c in match_result.candidates],
-                                    [c.offset for c in match_result.candidates],
-                                    [c.spdist for c in match_result.candidates],
-                                    [c.ep for c in match_result.candidates],
-                                    [c.tp for c in match_result.candidates],
-                                    ])
-                
-            except Exception as e:
-                print("Error processing row {}: {}".format(row_index, e))
+        # Generate the binary UBODT only if the network or the threshold changed
+        ubodt_file = cached_ubodt(network, graph, network_file, ubodt_distance_threshold, ubodt_cache_dir)
 
-    print("Map matching completed. Results saved to {}".format(output_file))
+        print("Starting map matching process with {} worker(s).".format(num_workers))
+        # Each worker builds its matcher session once
+        run_matching(match_batch, input_file, output_dir, checkpoint_file, trip_limit, batch_size, num_workers,
+                     resume, checkpoint_interval, initializer=load_session, initargs=(ubodt_file,))
+        print("Map matching completed. Results saved to {}".format(output_dir))
@@ -0,0 +1,75 @@
+import os
+import json
+import multiprocessing
+from hmm_matcher import HMMMatcher
+from matched_store import run_matching, values_record
+
+# Map matching without the fmm Docker image, with the NumPy HMM matcher of hmm_matcher.py.
+# Writes a store in the format of 03_map_matching.py next to it, so 04 and 05 run on either
+# (select it with MATCHED_STORE in 05) and both can be compared.
+
+# Define paths and parameters
+network_file = "./porto/edges.shp"
+path_table_cache_dir = "./data/path_table_cache"
+input_file = "./data/train-1500.csv"
+output_dir = "./data/matched_store_hmm"
+checkpoint_file = "./data/matched_store_hmm.checkpoint"
+trip_limit = 1500
+
+# Map matching parameters in meters
+search_radius = 200.0
+k_neighbors = 10
+gps_accuracy = 50.0
+path_table_delta = 2000.0  # Part of the path table cache key, changing it regenerates the table
+
+# Parallelism, num_workers = 1 matches in the main process
+num_workers = multiprocessing.cpu_count()
+batch_size = 64  # Trips handed to a worker at a time, their candidates are looked up together
+
+# Resuming, with resume = True trips recorded in checkpoint_file are skipped and
+# output_dir is appended to instead of being overwritten
+resume = True
+checkpoint_interval = 256  # Trips per durable commit of output and checkpoint
+
+# Matcher of this process, built once per worker by load_matcher (forked workers inherit it)
+matcher = None
+
+def load_matcher():
+    global matcher
+    if matcher is None:
+        matcher = HMMMatcher(network_file, k_neighbors, search_radius, gps_accuracy, path_table_delta, path_table_cache_dir)
+
+def match_batch(batch):
+    trips, trajectories = [], []
+    for row_index, trip_id, polyline in batch:
+        try:
+            trajectories.append(json.loads(polyline))
+            trips.append((row_index, trip_id))
+        except ValueError as e:
+            print(f"Error processing row {row_index}: {e}")
+
+    errors = []
+    match_results = matcher.match_many(trajectories, errors)
+    for i, e in errors:
+        print(f"Error processing row {trips[i][0]}: {e}")
+
+    # Only trips with a record are committed as done, so a resumed run retries the failed ones
+    done_trip_ids, records = [], []
+    for (row_index, trip_id), values in zip(trips, match_results):
+        if values is not None:
+            done_trip_ids.append(trip_id)
+            records.append(values_record(row_index, trip_id, values))
+    return done_trip_ids, records
+
+if __name__ == "__main__":
+    if not os.path.exists(network_file):
+        print(f"Network file {network_file} does not exist.")
+    else:
+        # Build the matcher and its path table once, before the workers start
+        load_matcher()
+        print(f"Loaded network with {len(matcher.node_ids)} nodes and {len(matcher.index)} edges.")
+
+        print(f"Starting map matching process with {num_workers} worker(s).")
+        run_matching(match_batch, input_file, output_dir, checkpoint_file, trip_limit, batch_size, num_workers,
+                     resume, checkpoint_interval, initializer=load_matcher)
+        print(f"Map matching completed. Results saved to {output_dir}")
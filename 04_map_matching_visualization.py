@@ -1,11 +1,12 @@
 import os
 import folium
-import pandas as pd
-import ast
+from folium_render import map_bounds, save_map, trip_layer, trip_map
+from trip_store import read_trips
+from matched_store import MatchedStore
 
-# Load the original and matched data
-df_original = pd.read_csv('./data/train-1500.csv')
-df_matched = pd.read_csv('./data/matched.csv')
+# Load the original trip ids and the matched data
+df_original, coords, offsets = read_trips('./data/train-1500.parquet', columns=['TRIP_ID', 'POLYLINE'])
+matches = MatchedStore('./data/matched_store')
 
 # Define target trip IDs as integers for matching
 target_trip_ids = [int("1372636854620000520"), int("1372638303620000112")]
@@ -30,46 +31,30 @@ for trip_id in trip_ids:
     
     orig_index = orig_index[0]  # Get the row index for matching
     
-    # Extract original coordinates from POLYLINE in train-1500.csv
-    original_coords = ast.literal_eval(df_original.loc[orig_index, 'POLYLINE'])
+    # Extract original coordinates of the trip
+    original_coords = coords[offsets[orig_index]:offsets[orig_index + 1]]
     
-    # Use the row index to find the matched row in matched_routines.csv
-    matched_row = df_matched.iloc[orig_index]
+    # Find the matched row of this trip in the matched store
+    try:
+        matched_row = matches.row_of(trip_id)
+    except KeyError:
+        print(f"Trip ID {trip_id} not found in the matched data.")
+        continue
     
-    # Extract matched coordinates from 'mgeom' as WKT LINESTRING
-    matched_coords = [
-        tuple(map(float, coord.split()))
-        for coord in matched_row['mapped_route_points'].replace("LINESTRING(", "").replace(")", "").split(",")
-    ]
+    # Extract matched coordinates from 'mgeom'
+    matched_coords = matches.get('mgeom', matched_row)
 
-    # Set bounding box for consistent centering across maps
-    all_points = original_coords + matched_coords
-    lons, lats = zip(*all_points)
-    margin = 0.005
-    lon_min, lon_max = min(lons) - margin, max(lons) + margin
-    lat_min, lat_max = min(lats) - margin, max(lats) + margin
-    center_lat = (lat_min + lat_max) / 2
-    center_lon = (lon_min + lon_max) / 2
-    
-    # Initialize map centered on route bounds
-    fmap = folium.Map(location=[center_lat, center_lon], zoom_start=13)
-    fmap.fit_bounds([[lat_min, lon_min], [lat_max, lon_max]])
+    # Initialize map centered on route bounds for consistent centering across maps
+    fmap = trip_map(map_bounds(original_coords, matched_coords), width='100%', height='100%')
     
     # Feature group for layered control
     feature_group = folium.FeatureGroup(name=f'Trip {trip_id}')
     
     # Plot original route in blue with points
-    folium.PolyLine([(lat, lon) for lon, lat in original_coords], color='blue', weight=2, opacity=0.7,
-                    tooltip="Original Route").add_to(feature_group)
-    for lon, lat in original_coords:
-        folium.CircleMarker(location=(lat, lon), radius=3, color='blue', fill=True, fill_opacity=1).add_to(feature_group)
+    trip_layer(original_coords, 'blue', opacity=0.7, tooltip="Original Route").add_to(feature_group)
     
     # Offset matched route points to avoid overlap and plot in red with points
-    matched_coords = [(lat + 0.001, lon + 0.001) for lat, lon in matched_coords]
-    folium.PolyLine([(lat, lon) for lon, lat in matched_coords], color='red', weight=2, opacity=0.7,
-                    tooltip="Matched Route").add_to(feature_group)
-    for lon, lat in matched_coords:
-        folium.CircleMarker(location=(lat, lon), radius=3, color='red', fill=True, fill_opacity=1).add_to(feature_group)
+    trip_layer(matched_coords + 0.001, 'red', opacity=0.7, tooltip="Matched Route").add_to(feature_group)
     
     # Add the feature group to the map
     fmap.add_child(feature_group)
@@ -82,5 +67,4 @@ for trip_id in trip_ids:
         os.makedirs('./data/matched/')
 
     # Save the map as an HTML file
-    fmap.save(f'./data/matched/route_map_trip_matched_{trip_id}.html')
-    print(f"Map for trip {trip_id} saved as route_map_trip_matched_{trip_id}.html")
+    save_map(fmap, f'./data/matched/route_map_trip_matched_{trip_id}.html')
@@ -1,54 +1,31 @@
 import os
-import re
-import heapq
+import time
 import requests 
 
 import pandas as pd 
 import numpy as np 
 import matplotlib.pyplot as plt
 
-from io import BytesIO
-from PIL import Image
-from collections import defaultdict
+from functools import reduce
+from concurrent.futures import ThreadPoolExecutor
+from trip_store import read_trips
+from matched_store import MatchedStore
+from traversal import edge_way_table
+from aggregate_store import AggregateStore, content_key
+from basemap import USER_AGENT, get_stitched_tiles, merge_bounding_boxes, prefetch_tiles
+from way_store import WayAttributes, WayStore, build_way_attributes, ways_from_edges
 
 OVERPASS_URL = "http://overpass-api.de/api/interpreter"
-USER_AGENT = "AI6128 Project"
-TILE_CACHE = {}
-WAY_CACHE = {}
+WAY_CACHE = WayStore('data/way_cache.sqlite')
+WAY_CHUNK_SIZE = 500  # way ids per Overpass query
+OVERPASS_WORKERS = 2  # concurrent Overpass queries, keep low to respect the rate limit
+OVERPASS_RETRIES = 5
+WAY_OFFLINE = False  # build missing ways from porto/edges.shp instead of querying Overpass
+MATCHED_STORE = 'data/matched_store'  # 'data/matched_store_hmm' for the results of 03_map_matching_hmm.py
+AGGREGATE_STORE = 'data/way_aggregates.npz'  # per-way aggregates of the matched trips absorbed so far
 print_for_latex = False
 K = 10
 
-def linestring_2_locations(x):
-    x = re.findall('-?\d+[.]\d+', x)
-    if len(x) == 0:
-        return np.zeros((0,2))
-    x = list(map(float, x))
-    x = np.array(x).reshape((-1,2))
-    
-    return x
-
-def s2l(x, type):
-    if type == int:
-        x = re.findall('\d+', x)
-    else:
-        x = re.findall('-?\d+[.]\d+', x)
-    x = list(map(type, x))
-    x = np.array(x)
-    
-    return x
-
-def to_int(x):
-    return s2l(x, int)
-
-def to_float(x):
-    return s2l(x, float)
-
-def merge_bounding_boxes(box1, box2):
-    min_x1, min_y1, max_x1, max_y1 = box1
-    min_x2, min_y2, max_x2, max_y2 = box2
-    
-    return np.min([min_x1,min_x2]), np.min([min_y1, min_y2]), np.max([max_x1, max_x2]), np.max([max_y1, max_y2])
-
 def lat_lon_padding(min_lon, min_lat, max_lon, max_lat, padding):
     avg_lat = np.radians((min_lat + max_lat) / 2)
     lat_padding = padding / 111320.0    
@@ -70,6 +47,11 @@ def pad_bounding_box(bbox, padding):
     return get_padded_bounding_box([min_lon, max_lon], [min_lat, max_lat], padding)
 
 
+def get_way_bbox(way, padding):
+    g = pd.DataFrame(way['geometry'])
+    
+    return get_padded_bounding_box(g.lon, g.lat, padding)
+
 def plot_bbox(bbox, ax, linewidth, color):
     min_lon, min_lat, max_lon, max_lat = bbox
     bbox_lon = [min_lon, min_lon, max_lon, max_lon, min_lon]
@@ -82,196 +64,92 @@ def plot_text_bbox(bbox, ax, text, color, fontsize):
     
     return ax.text(max_lon, max_lat, text, color=color, fontsize=fontsize)
 
-# https://wiki.openstreetmap.org/wiki/Slippy_map_tilenames
-def deg2num(lat_deg, lon_deg, zoom):    
-    lat_rad = np.radians(lat_deg)
-    n = 1 << zoom
-    xtile = int((lon_deg + 180.0) / 360.0 * n)
-    ytile = int((1.0 - np.arcsinh(np.tan(lat_rad)) / np.pi) / 2.0 * n)
-    
-    return xtile, ytile
-
-def get_tile_range(bbox, zoom):
-    min_lon, min_lat, max_lon, max_lat = bbox
-    x1, y1 = deg2num(min_lat, min_lon, zoom)
-    x2, y2 = deg2num(max_lat, max_lon, zoom)
-    min_x = np.min([x1,x2])
-    min_y = np.min([y1,y2])
-    max_x = np.max([x1,x2])
-    max_y = np.max([y1,y2])
-    
-    return min_x, min_y, max_x, max_y
-
-
-def tile_to_bbox(x_tile, y_tile, zoom):
-    n = 2 ** zoom
-    lon_left = x_tile / n * 360.0 - 180.0
-    lon_right = (x_tile + 1) / n * 360.0 - 180.0
-    lat_top = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * y_tile / n))))
-    lat_bottom = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y_tile + 1) / n))))
-    
-    return lon_left, lat_bottom, lon_right, lat_top
-
 ####### Begin definition of functions using requests #########
 
-def get_ways(way_ids):
-    required = []
-    for wid in way_ids:
-        if wid in WAY_CACHE:
-            continue
-        required.append(wid)
-
-    if len(required) > 0:
-        query = "[out:json];"
-        for wid in required:
-            query += f" way({wid}); out geom;"
-    
-        response = requests.post(OVERPASS_URL, data={"data": query})
-        data = response.json()
-        
-        for way in data['elements']:
-            WAY_CACHE[way['id']] = way
+# Query one chunk of ways, retrying with exponential backoff when Overpass is busy or times out
+def fetch_ways(way_ids):
+    query = "[out:json][timeout:180]; way(id:%s); out geom;" % ','.join(map(str, way_ids))
+    for attempt in range(OVERPASS_RETRIES):
+        try:
+            response = requests.post(OVERPASS_URL, data={"data": query}, headers={'User-Agent': USER_AGENT}, timeout=200)
+            if response.status_code != 429 and response.status_code < 500:
+                response.raise_for_status()
+                return response.json()['elements']
+        except (requests.ConnectionError, requests.Timeout):
+            pass
+        time.sleep(2 ** attempt)
+    raise RuntimeError(f'Overpass query for {len(way_ids)} ways failed after {OVERPASS_RETRIES} attempts')
 
-    ways = []
-    for wid in way_ids:
-        if wid in WAY_CACHE:
-            way = WAY_CACHE[wid]
-            ways.append(way)
-
-    return ways
+def get_ways(way_ids):
+    required = WAY_CACHE.missing(way_ids)
 
-def get_tile(z,x,y):    
-    tk = (z,x,y)
-    if tk in TILE_CACHE:
-        return TILE_CACHE[tk]
+    if len(required) > 0 and WAY_OFFLINE:
+        WAY_CACHE.put_many(ways_from_edges('porto/edges.shp', required))
+    elif len(required) > 0:
+        chunks = [required[i:i+WAY_CHUNK_SIZE] for i in range(0, len(required), WAY_CHUNK_SIZE)]
+        with ThreadPoolExecutor(max_workers=OVERPASS_WORKERS) as executor:
+            for chunk, ways in zip(chunks, executor.map(fetch_ways, chunks)):
+                WAY_CACHE.put_many(ways)
+                returned = set(way['id'] for way in ways)
+                WAY_CACHE.put_absent([wid for wid in chunk if wid not in returned])
 
-    
-    url = f'https://tile.openstreetmap.org/{z}/{x}/{y}.png'
-    
-    headers = {
-        'User-Agent': USER_AGENT
-    }
-    
-    response = requests.get(url, headers=headers)    
-    img = Image.open(BytesIO(response.content))
-    img = np.array(img.convert('RGB'))
-    
-    TILE_CACHE[tk] = img
-    return img
+    return WAY_CACHE.get_many(way_ids)
 
 ####### End definition of functions using requests #########
 
-def get_stitched_tiles(bbox, zoom):
-    min_x, min_y, max_x, max_y = get_tile_range(bbox, zoom)
-    tbbox1 = tile_to_bbox(min_x, min_y, zoom)
-    tbbox2 = tile_to_bbox(max_x, max_y, zoom)
-    min_lon, min_lat, max_lon, max_lat = merge_bounding_boxes(tbbox1, tbbox2)
-    extent = [min_lon, max_lon, min_lat, max_lat]
-
-    stitched = []
-    for y in range(min_y, max_y+1):
-        cols = []
-        for x in range(min_x, max_x+1):
-            tile = get_tile(zoom, x, y)
-            cols.append(tile)
-        row = np.hstack(cols)
-        stitched.append(row)
-    stitched = np.vstack(stitched)
-    
-    return stitched, extent
-
 if __name__ == '__main__':
     print('Load data...')
-    tdf = pd.read_csv('data/train-1500.csv')
-    mdf = pd.read_csv('data/matched.csv')
-    osm_edges = pd.read_csv('data/edges_eid_to_osmid.csv')
+    tdf, _, _ = read_trips('data/train-1500.parquet', columns=['TRIP_ID', 'TAXI_ID', 'TIMESTAMP', 'CALL_TYPE'])
+    matches = MatchedStore(MATCHED_STORE)
+    way_ids, way_offsets = edge_way_table('data/edges_eid_to_osmid.csv')
     os.makedirs('outputs', exist_ok=True)
 
-    # get all unique edge ids
-    all_eids_in_matches = []
-    for path in mdf.match_path:
-        all_eids_in_matches.extend(to_int(path))
-    all_eids_in_matches = list(set(all_eids_in_matches))
-
-    ### get all unique osm way ids in matches
-    all_wids_in_matches = []
-    for eid in all_eids_in_matches:
-        all_wids_in_matches.extend(to_int(osm_edges.iloc[eid].osmid))
-    all_wids_in_matches = list(set(all_wids_in_matches))
-    
-    print('Retrieve OSM way geometries...')
-    all_ways_in_matches = get_ways(all_wids_in_matches)
-
-    print('Computing approximate trajectory lengths of OSM ways...')
-    ### calculate length of ways
-    length_of_wids = defaultdict(lambda: 0)
-    wid_to_way = {}
-    for way in all_ways_in_matches:
-        g = pd.DataFrame(way['geometry'])    
-        dx = np.diff(g.lon)
-        dy = np.diff(g.lat)
-        segment_lengths = np.sqrt(dx**2 + dy**2)
-        trajectory_length = np.sum(segment_lengths)
-        length_of_wids[way['id']] = trajectory_length
-        wid_to_way[way['id']] = way    
-    
-    ### analysis of trip frequency
-    print('Analyzing Traversal Frequency...')
-    number_of_trips = defaultdict(lambda: 0)
-    for _, row in mdf.iterrows():
-        eids = to_int(row.match_path)
-        match_eids = to_int(row.match_edge_by_idx)
-        trip_wids = []
-        for i in range(len(match_eids)-1):
-            a = match_eids[i]
-            b = match_eids[i+1]
-            wids = to_int(str(osm_edges.iloc[eids[a:b+1]].osmid.values))
-            trip_wids.extend(wids)
-        trip_wids = set(trip_wids)
-        for wid in trip_wids:
-            number_of_trips[wid] += 1
-
-    #analysis of time spent
-    print('Analyzing Time Spent...')
-    time_spent = defaultdict(lambda: 0)    
-    for _, row in mdf.iterrows():
-        eids = to_int(row.match_path)
-        match_eids = to_int(row.match_edge_by_idx)
-        for i in range(len(match_eids)-1):
-            a = match_eids[i]
-            b = match_eids[i+1]
-            wids = to_int(str(osm_edges.iloc[eids[a:b+1]].osmid.values))
-            total_len = 0
-            for wid in wids:
-                l = length_of_wids[wid]
-                total_len += l
-            if total_len == 0:
-                continue
-            
-            for wid in wids:
-                l = length_of_wids[wid]
-                time_spent[wid] += 15 * l/total_len
+    # way lengths in meters from the local network, the table is rebuilt when edges.shp changes
+    if not os.path.exists('data/way_attributes/way_ids.npy') or \
+            os.path.getmtime('data/way_attributes/way_ids.npy') < os.path.getmtime('porto/edges.shp'):
+        print('Building OSM way attribute table...')
+        build_way_attributes('porto/edges.shp', 'data/way_attributes')
+    way_attributes = WayAttributes('data/way_attributes')
+
+    ### analysis of trip frequency and time spent
+    # per-way aggregates are kept in AGGREGATE_STORE and only the trips matched since the last
+    # run are absorbed, the store is rebuilt when the edge to way table or the way lengths change
+    # and when it holds the trips of another matched store
+    print('Analyzing Traversal Frequency and Time Spent...')
+    aggregate_key = content_key('data/edges_eid_to_osmid.csv', 'data/way_attributes/length.npy')
+    aggregate_store = AggregateStore(AGGREGATE_STORE, aggregate_key)
+    if set(aggregate_store.sources) - {os.path.normpath(MATCHED_STORE)}:
+        aggregate_store.reset()
+    try:
+        new_rows = aggregate_store.update(matches, way_ids, way_offsets, way_attributes.length_of)
+    except ValueError as e:
+        print(f'{e}, rebuilding')
+        aggregate_store.reset()
+        new_rows = aggregate_store.update(matches, way_ids, way_offsets, way_attributes.length_of)
+    if new_rows:
+        aggregate_store.save()
+    aggregates = aggregate_store.aggregates
+    print(f'{new_rows} new matched trips absorbed, {len(aggregates)} ways')
 
     print(f'Retrieving Top {K}...')
-    num_of_trips_list = []
-    avg_time_spent_list = []
-    
-    for wid in number_of_trips:
-        num_of_trips_list.append((wid, number_of_trips[wid]))
-    
-    for wid in time_spent:
-        if number_of_trips[wid] == 0:
-            continue
-        t = time_spent[wid]
-        n = number_of_trips[wid]
-        at = t/n
-        if n < 0:
-            continue
-        avg_time_spent_list.append((wid, at, t, n))
-    
-    # get top K
-    top_k_trips = heapq.nlargest(K, num_of_trips_list, key=lambda x: x[1])
-    top_k_avg_time = heapq.nlargest(K, avg_time_spent_list, key=lambda x: x[1])
+    rows = aggregates.top_trips(K)
+    top_k_trips = list(zip(aggregates.way_ids[rows].tolist(), aggregates.trips[rows].tolist()))
+    rows = aggregates.top_mean_time(K)
+    top_k_avg_time = list(zip(aggregates.way_ids[rows].tolist(), aggregates.mean_time()[rows].tolist(),
+                              aggregates.time[rows].tolist(), aggregates.trips[rows].tolist()))
+
+    # way geometries are only needed for the figures of the top ways
+    print('Retrieve OSM way geometries...')
+    top_wids = [wid for wid, _ in top_k_trips] + [wid for wid, _,_,_ in top_k_avg_time]
+    wid_to_way = {way['id']: way for way in get_ways(list(dict.fromkeys(top_wids)))}
+
+    # all tiles of the figures below are downloaded up front in one parallel pass
+    print('Prefetching map tiles...')
+    overall_5_1 = reduce(merge_bounding_boxes, [get_way_bbox(wid_to_way[wid], 100) for wid, _ in top_k_trips])
+    overall_5_2 = reduce(merge_bounding_boxes, [get_way_bbox(wid_to_way[wid], 400) for wid, _,_,_ in top_k_avg_time])
+    prefetch_tiles([(overall_5_1, 16), (overall_5_2, 14),
+                    (pad_bounding_box(merge_bounding_boxes(overall_5_1, overall_5_2), 100), 13)]
+                   + [(get_way_bbox(wid_to_way[wid], 40), 18) for wid in top_wids])
 
     # overall visualizations task 5.1
     print('Road Segments: Top-10 Most Traversed')
@@ -0,0 +1,80 @@
+import os
+import time
+import pandas as pd
+import numpy as np
+
+from trip_store import read_trips
+from matched_store import MatchedStore
+from traversal import edge_way_table
+from aggregate_store import content_key
+from way_store import WayAttributes, build_way_attributes
+from traffic_cube import CALL_TYPES, HOURS, TrafficCube, build_traffic_cube, read_cube_meta
+
+# Route analysis metrics of 05_route_analysis.py sliced by hour of day, DAY_TYPE and CALL_TYPE:
+# builds the way x time-bucket cube of traffic_cube.py when the matched trips or the way tables
+# changed and writes the top K ways of every hour and call type
+TRIPS_FILE = 'data/train-1500.parquet'
+MATCHED_STORE = 'data/matched_store'  # 'data/matched_store_hmm' for the results of 03_map_matching_hmm.py
+CUBE_DIR = 'data/traffic_cube'
+K = 10
+
+def cube_meta(matches):
+    return {
+        'key': content_key('data/edges_eid_to_osmid.csv', 'data/way_attributes/length.npy'),
+        'trips_file': [os.path.getsize(TRIPS_FILE), os.path.getmtime(TRIPS_FILE)],
+        'matched_store': os.path.normpath(matches.directory),
+        'matched_run_id': matches.run_id,
+        'matched_rows': len(matches),
+        'last_trip_id': int(matches.trip_ids[-1]) if len(matches) else None,
+    }
+
+if __name__ == '__main__':
+    matches = MatchedStore(MATCHED_STORE)
+    if not os.path.exists('data/way_attributes/way_ids.npy') or \
+            os.path.getmtime('data/way_attributes/way_ids.npy') < os.path.getmtime('porto/edges.shp'):
+        print('Building OSM way attribute table...')
+        build_way_attributes('porto/edges.shp', 'data/way_attributes')
+
+    meta = cube_meta(matches)
+    stored = read_cube_meta(CUBE_DIR)
+    if stored is None or {name: stored.get(name) for name in meta} != meta:
+        print('Building traffic cube...')
+        start_time = time.perf_counter()
+        trips, _, _ = read_trips(TRIPS_FILE, columns=['TRIP_ID', 'TIMESTAMP', 'DAY_TYPE', 'CALL_TYPE'])
+        way_ids, way_offsets = edge_way_table('data/edges_eid_to_osmid.csv')
+        num_trips = build_traffic_cube(matches, trips, way_ids, way_offsets,
+                                       WayAttributes('data/way_attributes').length_of, CUBE_DIR, meta)
+        print(f'{num_trips} of {len(matches)} matched trips in the cube ({time.perf_counter() - start_time:.2f} s)')
+    cube = TrafficCube(CUBE_DIR)
+
+    print(f'Retrieving Top {K} per hour and call type...')
+    start_time = time.perf_counter()
+    entries = []
+    for hour in range(HOURS):
+        for call_type in [None] + CALL_TYPES:
+            aggregates = cube.slice(hours=hour, call_types=call_type)
+            for metric, rows, values in [('n_trips', aggregates.top_trips(K), aggregates.trips),
+                                         ('avg_time', aggregates.top_mean_time(K), aggregates.mean_time())]:
+                for rank, row in enumerate(rows):
+                    entries.append({
+                        'hour': hour,
+                        'call_type': call_type or 'all',
+                        'metric': metric,
+                        'rank': rank + 1,
+                        'id': int(aggregates.way_ids[row]),
+                        'value': float(values[row]),
+                        'n_trips': int(aggregates.trips[row]),
+                    })
+    elapsed = time.perf_counter() - start_time
+    print(f'{HOURS * (len(CALL_TYPES) + 1)} slices of {len(cube)} ways in {elapsed:.2f} s')
+
+    os.makedirs('outputs', exist_ok=True)
+    pd.DataFrame(entries).to_csv('outputs/task_5_cube_top10.csv', index=False)
+
+    # busiest way over the day
+    wids, counts = cube.top_trips(1)
+    if len(wids):
+        trips_by_hour, mean_time_by_hour = cube.hourly(wids)
+        print(f'Way {wids[0]} ({counts[0]} trips) by hour:')
+        for hour in np.flatnonzero(trips_by_hour[0]):
+            print('%02d:00 \t n=%d \t avg time %.1f s' % (hour, trips_by_hour[0][hour], mean_time_by_hour[0][hour]))
@@ -1,70 +1,100 @@
 import os
+import multiprocessing
+from collections import deque
+import numpy as np
 import matplotlib.pyplot as plt
-import pandas as pd
-import math
-import ast
+from polylines import encode_polyline
+from trip_store import TripStoreWriter, iter_trips
+from trajectory_filter import filter_outliers, segment_lengths
 
-# Create up output folder
-os.makedirs('./data/task_6_results', exist_ok=True)
+# Define paths and parameters
+input_store = './data/train-1500.parquet'  # or './data/train.parquet' (full_corpus_store of 01) to clean the full dataset
+output_dir = './data/task_6_results'
+chunk_size = 2000  # Trips handed to a worker at a time
 
-# Load and filter data
-df = pd.read_csv('./data/train-1500.csv')
-trip_data = df[df['TRIP_ID'].isin(df["TRIP_ID"].unique())]
-trip_data['POLYLINE'] = trip_data['POLYLINE'].apply(ast.literal_eval)
+# Parallelism, num_workers = 1 cleans in the main process
+num_workers = multiprocessing.cpu_count()
 
-# Calculate consecutive distances between GPS points
-consecutive_dis_before = [
-    math.sqrt((polyline[i][0] - polyline[i + 1][0]) ** 2 + (polyline[i][1] - polyline[i + 1][1]) ** 2) * 100
-    for polyline in trip_data['POLYLINE'] if len(polyline) > 1
-    for i in range(len(polyline) - 1)
-]
+#Outlier filter thresholds in meters
+min_thresh, max_thresh, step_thresh = 500, 10000, 500
+noise_thresh = 20
 
-# Plot histogram before applying the algorithm
-plt.figure(figsize=(10, 6))
-plt.hist(consecutive_dis_before, bins=50, color='blue', edgecolor='black', range=(0, 2), log=True)
-plt.xlabel('Euclidean Distance (units)', fontsize=15)
-plt.ylabel('Frequency (Log Scale)', fontsize=15)
-plt.xticks(fontsize=12)
-plt.yticks(fontsize=12)
-plt.savefig("./data/task_6_results/consecutive_distances_histogram_before.png")
-plt.close()
+# Histograms of consecutive distances are accumulated chunk by chunk over fixed bins
+histogram_bins = np.linspace(0, 2000, 51)
 
-#Remove outliers from trip data
-min_thresh, max_thresh, step_thresh = 0.005, 0.1, 0.005
-noise_thresh = 0.0002
-for index, row in trip_data.iterrows():
-    polyline = row['POLYLINE']
-    if len(polyline) < 2:
-        continue
-    modified_points = [polyline[0]]
-    last_point, threshold = polyline[0], min_thresh
-    for next_point in polyline[1:]:
-        distance = math.sqrt((last_point[0] - next_point[0])**2 + (last_point[1] - next_point[1])**2)
-        if distance < threshold and distance > noise_thresh:
-            modified_points.append(next_point)
-            last_point, threshold = next_point, min_thresh
-        else:
-            threshold = min(threshold + step_thresh, max_thresh)
-    trip_data.at[index, 'POLYLINE'] = modified_points
+# Remove noise and jumps from one chunk of trips of the trip store, whose consecutive
+# duplicate points were already dropped when 01_take-1500.py wrote it
+def clean_chunk(chunk):
+    trips, coords, offsets = chunk
+    histogram_before = np.histogram(segment_lengths(coords, offsets), bins=histogram_bins)[0]
 
-# Calculate consecutive distances after applying the algorithm
-consecutive_dis_after = [
-    math.sqrt((polyline[i][0] - polyline[i + 1][0]) ** 2 + (polyline[i][1] - polyline[i + 1][1]) ** 2) * 100
-    for polyline in trip_data['POLYLINE'] if len(polyline) > 1
-    for i in range(len(polyline) - 1)
-]
+    coords, offsets = filter_outliers(coords, offsets, min_thresh, max_thresh, step_thresh, noise_thresh)
+    histogram_after = np.histogram(segment_lengths(coords, offsets), bins=histogram_bins)[0]
 
-# Plot histogram after applying the algorithm
-plt.figure(figsize=(10, 6))
-plt.hist(consecutive_dis_after, bins=50, color='green', edgecolor='black', range=(0, 2), log=True)
-plt.xlabel('Euclidean Distance (units)', fontsize=15)
-plt.ylabel('Frequency (Log Scale)', fontsize=15)
-plt.xticks(fontsize=12)
-plt.yticks(fontsize=12)
-plt.savefig("./data/task_6_results/consecutive_distances_histogram_after.png")
-plt.close()
+    trips = trips.copy()
+    trips['POLYLINE'] = [encode_polyline(coords[offsets[i]:offsets[i + 1]]) for i in range(len(trips))]
+    return trips, coords, offsets, histogram_before, histogram_after
 
-# Save the improved data
-trip_data.to_csv("./data/task_6_results/improved_trip_data.csv", index=False)
+# Like pool.imap, but with at most window chunks in flight so memory stays flat on any input size
+def imap_bounded(pool, function, iterable, window):
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.apply_async(function, (item,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
 
-print("Processing complete. Results saved in:", './data/task_6_results')
+def plot_histogram(counts, color, path):
+    plt.figure(figsize=(10, 6))
+    plt.hist(histogram_bins[:-1], bins=histogram_bins, weights=counts, color=color, edgecolor='black', log=True)
+    plt.xlabel('Haversine Distance (m)', fontsize=15)
+    plt.ylabel('Frequency (Log Scale)', fontsize=15)
+    plt.xticks(fontsize=12)
+    plt.yticks(fontsize=12)
+    plt.savefig(path)
+    plt.close()
+
+if __name__ == '__main__':
+    # Create up output folder
+    os.makedirs(output_dir, exist_ok=True)
+    csv_file = os.path.join(output_dir, 'improved_trip_data.csv')
+
+    # Stream the trip store in chunks, the points come back without parsing any text
+    chunks = iter_trips(input_store, batch_size=chunk_size)
+    pool = None
+    if num_workers > 1:
+        # Results come back in input order, so the output keeps the order of the trips
+        pool = multiprocessing.Pool(num_workers)
+        results = imap_bounded(pool, clean_chunk, chunks, 2 * num_workers)
+    else:
+        results = (clean_chunk(chunk) for chunk in chunks)
+
+    histogram_before = np.zeros(len(histogram_bins) - 1, dtype=np.int64)
+    histogram_after = np.zeros(len(histogram_bins) - 1, dtype=np.int64)
+    num_trips = 0
+    try:
+        # Save the improved data to the trip store and as CSV while cleaning, both only
+        # replace the outputs of an earlier run once all trips are cleaned
+        with TripStoreWriter(os.path.join(output_dir, 'improved_trip_data.parquet')) as writer:
+            for trip_data, coords, offsets, before, after in results:
+                writer.write(trip_data, coords, offsets)
+                trip_data.to_csv(csv_file + '.tmp', mode='w' if num_trips == 0 else 'a', header=num_trips == 0, index=False)
+                histogram_before += before
+                histogram_after += after
+                num_trips += len(trip_data)
+                print(f"Cleaned {num_trips} trips.")
+        if num_trips:
+            os.replace(csv_file + '.tmp', csv_file)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        if os.path.exists(csv_file + '.tmp'):
+            os.remove(csv_file + '.tmp')
+
+    # Plot histograms before and after applying the algorithm
+    plot_histogram(histogram_before, 'blue', os.path.join(output_dir, 'consecutive_distances_histogram_before.png'))
+    plot_histogram(histogram_after, 'green', os.path.join(output_dir, 'consecutive_distances_histogram_after.png'))
+
+    print("Processing complete. Results saved in:", output_dir)
@@ -1,62 +1,44 @@
 import folium
-import pandas as pd
-import ast
+from folium_render import add_trips, map_bounds, save_map, trip_map
+from polylines import split_lists
+from trip_store import read_trips
 
-# Load data
-df = pd.read_csv('./data/task_6_results/improved_trip_data.csv')
+# Identify the specific trips to plot
+trip_ids_to_plot = [1372636854620000520, 1372638303620000112]
+
+# Read only the trips of interest from the improved trip store
+df, coords, offsets = read_trips('./data/task_6_results/improved_trip_data.parquet', columns=['TRIP_ID', 'POLYLINE'],
+                                 trip_ids=trip_ids_to_plot)
+trip_coords_by_id = dict(zip(df['TRIP_ID'].tolist(), split_lists(coords, offsets)))
+
+def load_trip_coords(trip_id):
+    return [trip_coords_by_id[int(trip_id)]]
 
 # Function to plot trips based on specific TRIP_ID
-def plot_trip(trip_id, color, map_center, map_bounds, filename):
-    trip_data = df[df['TRIP_ID'] == trip_id]
-    trip_coords = [ast.literal_eval(polyline) for polyline in trip_data['POLYLINE']]
-    fmap = folium.Map(location=map_center, zoom_start=13, width=1500, height=1000)
-    fmap.fit_bounds(map_bounds)
-
-    feature_group = folium.FeatureGroup(name=f'Trip {trip_id}')
-    for coords in trip_coords:
-        [folium.CircleMarker(location=(lat, lon), radius=3, color=color, fill=True, fill_opacity=1).add_to(feature_group) for lon, lat in coords]
-        folium.PolyLine([(lat, lon) for lon, lat in coords], color=color, weight=2).add_to(feature_group)
-    fmap.add_child(feature_group)
+def plot_trip(trip_id, color, bounds, filename):
+    trip_coords = load_trip_coords(trip_id)
+    fmap = trip_map(bounds)
+    add_trips(fmap, trip_coords, [color] * len(trip_coords), [f'Trip {trip_id}'] * len(trip_coords))
     fmap.add_child(folium.LayerControl())
-    fmap.save(filename)
-    print(f"Map saved as {filename}")
-
-# Identify the specific trips to plot
-trip_ids_to_plot = [1372636854620000520, 1372638303620000112]
+    save_map(fmap, filename)
 
 # Extract coordinates for bounding box calculation
 all_points = []
 for trip_id in trip_ids_to_plot:
-    trip_data = df[df['TRIP_ID'] == trip_id]
-    trip_coords = [ast.literal_eval(polyline) for polyline in trip_data['POLYLINE']]
-    all_points.extend([point for trip in trip_coords for point in trip])
-
-lons, lats = zip(*all_points)
+    trip_coords = load_trip_coords(trip_id)
+    all_points.extend(trip_coords)
 
 # Set map boundaries with margin
-margin = 0.005
-lon_min, lon_max = min(lons) - margin, max(lons) + margin
-lat_min, lat_max = min(lats) - margin, max(lats) + margin
-map_center = [(lat_min + lat_max) / 2, (lon_min + lon_max) / 2]
-map_bounds = [[lat_min, lon_min], [lat_max, lon_max]]
+bounds = map_bounds(*all_points)
 
 # Plot maps for individual trips
-plot_trip('1372636854620000520', 'blue', map_center, map_bounds, './data/task_6_results/trip_1372636854620000520_.html')
-plot_trip('1372638303620000112', 'red', map_center, map_bounds, './data/task_6_results/trip_1372638303620000112_.html')
+plot_trip('1372636854620000520', 'blue', bounds, './data/task_6_results/trip_1372636854620000520_.html')
+plot_trip('1372638303620000112', 'red', bounds, './data/task_6_results/trip_1372638303620000112_.html')
 
 # Create a combined map with both trips
-combined_map = folium.Map(location=map_center, zoom_start=13, width=1500, height=1000)
-combined_map.fit_bounds(map_bounds)
-
-for trip_id, color in zip(trip_ids_to_plot, ['blue', 'red']):
-    trip_data = df[df['TRIP_ID'] == trip_id]
-    trip_coords = [ast.literal_eval(polyline) for polyline in trip_data['POLYLINE']]
-    feature_group = folium.FeatureGroup(name=f'Trip {trip_id}')
-    for coords in trip_coords:
-        [folium.CircleMarker(location=(lat, lon), radius=3, color=color, fill=True, fill_opacity=1).add_to(feature_group) for lon, lat in coords]
-        folium.PolyLine([(lat, lon) for lon, lat in coords], color=color, weight=2).add_to(feature_group)
-    combined_map.add_child(feature_group)
+combined_map = trip_map(bounds)
+add_trips(combined_map, [load_trip_coords(trip_id)[0] for trip_id in trip_ids_to_plot], ['blue', 'red'],
+          [f'Trip {trip_id}' for trip_id in trip_ids_to_plot])
 
 combined_map.add_child(folium.LayerControl())
-combined_map.save('./data/task_6_results/combined_trips_map.html')
-print("Combined map saved as ./data/task_6_results/combined_trips_map.html")
+save_map(combined_map, './data/task_6_results/combined_trips_map.html')
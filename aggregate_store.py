@@ -0,0 +1,146 @@
+import os
+import json
+import hashlib
+import numpy as np
+from ragged import slice_rows
+from traversal import trip_way_times
+
+# Running per-way aggregates of the route analysis (05): for every way the number of trips using
+# it, the number of those that were timed, the total time spent on it and the sum of squares of
+# the per-trip times. All fields are sums, so batches of matched trips are absorbed and shards
+# are merged by adding them up, and the mean (time / trips) and standard deviation follow from them.
+FIELDS = ['way_ids', 'trips', 'timed_trips', 'time', 'time_sq']
+CHUNK_ROWS = 50000  # matched trips per aggregation pass while absorbing a store
+
+# Key of the inputs the aggregates depend on besides the matched trips (edge to way table, way
+# lengths), a store built with another key is discarded
+def content_key(*paths):
+    digest = hashlib.sha1()
+    for path in paths:
+        digest.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()[:16]
+
+class WayAggregates:
+    def __init__(self, way_ids=None, trips=None, timed_trips=None, time=None, time_sq=None):
+        self.way_ids = np.zeros(0, dtype=np.int64) if way_ids is None else np.asarray(way_ids, dtype=np.int64)
+        count = np.zeros(len(self.way_ids), dtype=np.int64)
+        total = np.zeros(len(self.way_ids), dtype=np.float64)
+        self.trips = count.copy() if trips is None else np.asarray(trips, dtype=np.int64)
+        self.timed_trips = count.copy() if timed_trips is None else np.asarray(timed_trips, dtype=np.int64)
+        self.time = total.copy() if time is None else np.asarray(time, dtype=np.float64)
+        self.time_sq = total.copy() if time_sq is None else np.asarray(time_sq, dtype=np.float64)
+
+    # Aggregates of (trip, way) entries as returned by traversal.trip_way_times
+    @classmethod
+    def from_trip_way_times(cls, wids, times, timed):
+        way_ids, way_index = np.unique(wids, return_inverse=True)
+        way_index = way_index.reshape(-1)
+        n = len(way_ids)
+        return cls(way_ids,
+                   np.bincount(way_index, minlength=n),
+                   np.bincount(way_index[timed], minlength=n),
+                   np.bincount(way_index, weights=times, minlength=n),
+                   np.bincount(way_index, weights=np.square(times), minlength=n))
+
+    # Aggregates of matched trips in the ragged layout of MatchedStore.ragged
+    @classmethod
+    def from_matches(cls, cpath, cpath_offsets, indices, indices_offsets, way_ids, way_offsets, length_of):
+        _, wids, times, timed = trip_way_times(cpath, cpath_offsets, indices, indices_offsets,
+                                               way_ids, way_offsets, length_of)
+        return cls.from_trip_way_times(wids, times, timed)
+
+    def __len__(self):
+        return len(self.way_ids)
+
+    # Sum of both aggregates over the union of their ways
+    def merge(self, other):
+        merged = WayAggregates(np.union1d(self.way_ids, other.way_ids))
+        for part in (self, other):
+            rows = np.searchsorted(merged.way_ids, part.way_ids)
+            for field in FIELDS[1:]:
+                getattr(merged, field)[rows] += getattr(part, field)
+        return merged
+
+    # Mean time per trip on each way, trips that received no share of time count as zero
+    def mean_time(self):
+        return self.time / np.maximum(self.trips, 1)
+
+    def std_time(self):
+        mean = self.mean_time()
+        return np.sqrt(np.maximum(self.time_sq / np.maximum(self.trips, 1) - mean ** 2, 0.0))
+
+    # Rows of the k ways used by the most trips, ties by way id
+    def top_trips(self, k):
+        return np.lexsort((self.way_ids, -self.trips))[:k]
+
+    # Rows of the k timed ways with the highest mean time per trip, ties by way id
+    def top_mean_time(self, k):
+        timed = np.flatnonzero(self.timed_trips > 0)
+        return timed[np.lexsort((self.way_ids[timed], -self.mean_time()[timed]))][:k]
+
+# WayAggregates in a single .npz file together with the matched stores absorbed into it:
+# sources maps the store directory to its run id, the number of its rows absorbed and the trip
+# id of the last one. Matched stores are append-only (03 with resume), so an update reads only
+# the rows added since the last one.
+class AggregateStore:
+    def __init__(self, path='data/way_aggregates.npz', key=''):
+        self.path = path
+        self.key = key
+        self.reset()
+        if os.path.exists(path):
+            with np.load(path) as data:
+                if str(data['key']) == key:
+                    self.aggregates = WayAggregates(*[data[field] for field in FIELDS])
+                    self.sources = json.loads(str(data['sources']))
+
+    def reset(self):
+        self.aggregates = WayAggregates()
+        self.sources = {}
+
+    def absorb(self, aggregates):
+        self.aggregates = self.aggregates.merge(aggregates)
+
+    # Adds the aggregates of another shard, a store absorbed by both would be counted twice
+    def merge(self, other):
+        if other.key != self.key:
+            raise ValueError(f'Aggregate stores of different inputs ({self.key} and {other.key})')
+        shared = set(self.sources) & set(other.sources)
+        if shared:
+            raise ValueError(f'Matched stores absorbed by both shards: {sorted(shared)}')
+        self.absorb(other.aggregates)
+        self.sources.update(other.sources)
+
+    # Absorbs the rows of the MatchedStore store added since the last update, returns their number.
+    # Raises ValueError if the store was rewritten since (another run id, fewer rows or another trip
+    # at the last one).
+    def update(self, store, way_ids, way_offsets, length_of, chunk_rows=CHUNK_ROWS):
+        source = os.path.normpath(store.directory)
+        done = self.sources.get(source, {'run_id': store.run_id, 'rows': 0, 'last_trip_id': None})
+        start = done['rows']
+        if done.get('run_id') != store.run_id or start > len(store) or \
+                (start and int(store.trip_ids[start - 1]) != done['last_trip_id']):
+            raise ValueError(f'{source} was rewritten since it was absorbed into {self.path}')
+        if start == len(store):
+            return 0
+
+        cpath, cpath_offsets = store.ragged('cpath')
+        indices, indices_offsets = store.ragged('indices')
+        for first in range(start, len(store), chunk_rows):
+            last = min(first + chunk_rows, len(store))
+            self.absorb(WayAggregates.from_matches(
+                *slice_rows(cpath, cpath_offsets, first, last), *slice_rows(indices, indices_offsets, first, last),
+                way_ids, way_offsets, length_of))
+        self.sources[source] = {'run_id': store.run_id, 'rows': len(store), 'last_trip_id': int(store.trip_ids[-1])}
+        return len(store) - start
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + '.tmp.npz'
+        np.savez(tmp_path, key=np.array(self.key), sources=np.array(json.dumps(self.sources)),
+                 **{field: getattr(self.aggregates, field) for field in FIELDS})
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,134 @@
+import atexit
+import threading
+import requests
+import numpy as np
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from PIL import Image
+from tile_cache import TileCache
+
+# OSM basemap tiles: persistent cache, concurrent prefetching and stitching of the tiles
+# covering a bounding box, shared by the figures of 05_route_analysis.py and static_render.py
+USER_AGENT = "AI6128 Project"
+TILE_URL = 'https://tile.openstreetmap.org/{z}/{x}/{y}.png'  # or a local tile server
+TILE_CACHE_PATH = 'data/tile_cache.sqlite'
+TILE_CACHE_BYTES = 512 * 1024 * 1024
+TILE_OFFLINE = False  # only use tiles already in the tile cache
+TILE_WORKERS = 8  # concurrent tile downloads
+DECODED_TILES = 256  # decoded tiles kept in memory (192 KB each)
+TILE_SESSION = requests.Session()
+TILE_SESSION.headers['User-Agent'] = USER_AGENT
+TILE_SESSION.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=TILE_WORKERS))
+TILE_SESSION.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=TILE_WORKERS))
+
+_tile_cache = None
+_tile_cache_lock = threading.Lock()
+
+# The persistent tile cache, opened on first use so importing basemap creates no files
+def tile_cache():
+    global _tile_cache
+    with _tile_cache_lock:
+        if _tile_cache is None:
+            _tile_cache = TileCache(TILE_CACHE_PATH, max_bytes=TILE_CACHE_BYTES)
+            atexit.register(_tile_cache.close)
+    return _tile_cache
+
+def merge_bounding_boxes(box1, box2):
+    min_x1, min_y1, max_x1, max_y1 = box1
+    min_x2, min_y2, max_x2, max_y2 = box2
+    
+    return np.min([min_x1,min_x2]), np.min([min_y1, min_y2]), np.max([max_x1, max_x2]), np.max([max_y1, max_y2])
+
+# https://wiki.openstreetmap.org/wiki/Slippy_map_tilenames
+def deg2num(lat_deg, lon_deg, zoom):    
+    lat_rad = np.radians(lat_deg)
+    n = 1 << zoom
+    xtile = int((lon_deg + 180.0) / 360.0 * n)
+    ytile = int((1.0 - np.arcsinh(np.tan(lat_rad)) / np.pi) / 2.0 * n)
+    
+    return xtile, ytile
+
+def get_tile_range(bbox, zoom):
+    min_lon, min_lat, max_lon, max_lat = bbox
+    x1, y1 = deg2num(min_lat, min_lon, zoom)
+    x2, y2 = deg2num(max_lat, max_lon, zoom)
+    min_x = np.min([x1,x2])
+    min_y = np.min([y1,y2])
+    max_x = np.max([x1,x2])
+    max_y = np.max([y1,y2])
+    
+    return min_x, min_y, max_x, max_y
+
+
+def tile_to_bbox(x_tile, y_tile, zoom):
+    n = 2 ** zoom
+    lon_left = x_tile / n * 360.0 - 180.0
+    lon_right = (x_tile + 1) / n * 360.0 - 180.0
+    lat_top = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * y_tile / n))))
+    lat_bottom = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y_tile + 1) / n))))
+    
+    return lon_left, lat_bottom, lon_right, lat_top
+
+# PNG bytes of a tile, downloaded over the pooled TILE_SESSION if not cached yet
+def fetch_tile(z,x,y):
+    data = tile_cache().get(z, x, y)
+    if data is None:
+        if TILE_OFFLINE:
+            raise KeyError(f'Tile {z}/{x}/{y} is not in the tile cache')
+        
+        url = TILE_URL.format(z=z, x=x, y=y)
+        response = TILE_SESSION.get(url)    
+        response.raise_for_status()
+        data = response.content
+        tile_cache().put(z, x, y, data)
+    
+    return data
+
+# Download all tiles of the given (bbox, zoom) pairs that are not cached yet, TILE_WORKERS at a time
+def prefetch_tiles(bbox_zooms):
+    keys = set()
+    for bbox, zoom in bbox_zooms:
+        min_x, min_y, max_x, max_y = get_tile_range(bbox, zoom)
+        for y in range(min_y, max_y+1):
+            for x in range(min_x, max_x+1):
+                keys.add((zoom, x, y))
+    
+    cache = tile_cache()
+    missing = [key for key in sorted(keys) if key not in cache]
+    if len(missing) == 0 or TILE_OFFLINE:
+        return
+    
+    with ThreadPoolExecutor(max_workers=TILE_WORKERS) as executor:
+        list(executor.map(lambda key: fetch_tile(*key), missing))
+
+# tiles are cached as PNG and only decoded when used, the last DECODED_TILES decoded tiles are kept
+@lru_cache(maxsize=DECODED_TILES)
+def get_tile(z,x,y):    
+    data = fetch_tile(z, x, y)
+    
+    img = Image.open(BytesIO(data))
+    img = np.array(img.convert('RGB'))
+    img.setflags(write=False)
+    
+    return img
+
+def get_stitched_tiles(bbox, zoom):
+    min_x, min_y, max_x, max_y = get_tile_range(bbox, zoom)
+    tbbox1 = tile_to_bbox(min_x, min_y, zoom)
+    tbbox2 = tile_to_bbox(max_x, max_y, zoom)
+    min_lon, min_lat, max_lon, max_lat = merge_bounding_boxes(tbbox1, tbbox2)
+    extent = [min_lon, max_lon, min_lat, max_lat]
+
+    stitched = []
+    for y in range(min_y, max_y+1):
+        cols = []
+        for x in range(min_x, max_x+1):
+            tile = get_tile(zoom, x, y)
+            cols.append(tile)
+        row = np.hstack(cols)
+        stitched.append(row)
+    stitched = np.vstack(stitched)
+    
+    return stitched, extent
+
@@ -0,0 +1,54 @@
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from matched_store import MatchedStore
+from traversal import edge_way_table
+from way_store import WayAttributes
+from ragged import slice_rows
+from aggregate_store import AggregateStore, WayAggregates
+
+# Cost of the route analysis aggregates: a full pass over all matched trips against absorbing
+# only the last new_share of them into a store holding the rest (a daily append), merging two
+# shards and the top-K queries
+store_dir = './data/matched_store'
+new_share = 0.1
+K = 10
+
+def timed(name, run, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = run()
+        best = min(best, time.perf_counter() - start_time)
+    print(f"{name:<32} {best * 1000:9.1f} ms")
+    return result
+
+matches = MatchedStore(store_dir)
+way_ids, way_offsets = edge_way_table('./data/edges_eid_to_osmid.csv')
+length_of = WayAttributes('./data/way_attributes').length_of
+cpath, cpath_offsets = matches.ragged('cpath')
+indices, indices_offsets = matches.ragged('indices')
+split = int(len(matches) * (1 - new_share))
+print(f"{len(matches)} matched trips, {len(matches) - split} new")
+
+def aggregate(start, stop):
+    return WayAggregates.from_matches(*slice_rows(cpath, cpath_offsets, start, stop),
+                                      *slice_rows(indices, indices_offsets, start, stop),
+                                      way_ids, way_offsets, length_of)
+
+full = timed('full pass', lambda: aggregate(0, len(matches)))
+old = aggregate(0, split)
+new = timed('new trips only', lambda: aggregate(split, len(matches)))
+merged = timed('merge', lambda: old.merge(new))
+print(f"{len(full)} ways, merged equals full pass: {np.array_equal(merged.trips, full.trips) and np.allclose(merged.time, full.time)}")
+timed(f'top {K} trips', lambda: merged.top_trips(K))
+timed(f'top {K} mean time', lambda: merged.top_mean_time(K))
+
+store = AggregateStore('./data/bench_way_aggregates.npz')
+store.update(matches, way_ids, way_offsets, length_of)
+timed('save', store.save)
+timed('load', lambda: AggregateStore('./data/bench_way_aggregates.npz'))
+os.remove('./data/bench_way_aggregates.npz')
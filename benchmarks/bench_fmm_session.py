@@ -0,0 +1,62 @@
+import os
+import sys
+import csv
+import json
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fmm import FastMapMatch, FastMapMatchConfig, Network, NetworkGraph, UBODT
+from fmm_session import MatcherSession, cached_ubodt, trajectory_to_wkt
+
+# Per-trip overhead of building FastMapMatch/FastMapMatchConfig for every trip
+# (the old 03_map_matching.py loop) against one reused MatcherSession.
+# Runs inside the fmm Docker image: python benchmarks/bench_fmm_session.py
+network_file = "./porto/edges.shp"
+ubodt_cache_dir = "./data/ubodt_cache"
+ubodt_distance_threshold = 0.02
+input_file = "./data/train-1500.csv"
+num_trips = 200
+search_radius = 0.05
+k_neighbors = 10
+gps_accuracy = 0.005
+
+network = Network(network_file, "fid", "u", "v")
+graph = NetworkGraph(network)
+ubodt = UBODT.read_ubodt_binary(cached_ubodt(network, graph, network_file, ubodt_distance_threshold, ubodt_cache_dir))
+
+with open(input_file, "r") as csv_input:
+    trajectories = [json.loads(row["POLYLINE"]) for _, row in zip(range(num_trips), csv.DictReader(csv_input))]
+
+def per_trip():
+    for trajectory in trajectories:
+        map_matcher = FastMapMatch(network, graph, ubodt)
+        map_matcher_config = FastMapMatchConfig(k_neighbors, search_radius, gps_accuracy)
+        map_matcher.match_wkt(trajectory_to_wkt(trajectory), map_matcher_config)
+
+def construct_only():
+    for _ in trajectories:
+        FastMapMatch(network, graph, ubodt)
+        FastMapMatchConfig(k_neighbors, search_radius, gps_accuracy)
+
+session = MatcherSession(network, graph, ubodt, k_neighbors, search_radius, gps_accuracy)
+
+def session_match():
+    for trajectory in trajectories:
+        session.match(trajectory)
+
+def session_match_many():
+    session.match_many(trajectories)
+
+print("{} trips".format(len(trajectories)))
+timings = {}
+for name, run in [("per-trip FastMapMatch", per_trip),
+                  ("construction only", construct_only),
+                  ("MatcherSession.match", session_match),
+                  ("MatcherSession.match_many", session_match_many)]:
+    start_time = time.time()
+    run()
+    timings[name] = time.time() - start_time
+    print("{:<28} {:9.1f} ms \t {:7.3f} ms/trip".format(name, timings[name] * 1000, timings[name] * 1000 / len(trajectories)))
+
+overhead = (timings["per-trip FastMapMatch"] - timings["MatcherSession.match_many"]) / len(trajectories)
+print("Per-trip overhead removed: {:.3f} ms".format(overhead * 1000))
@@ -0,0 +1,70 @@
+import os
+import sys
+import time
+import numpy as np
+import folium
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from polylines import split_lists
+from trip_store import read_trips
+from folium_render import add_trips, map_bounds, trip_map
+
+# HTML size, write time and browser load time of the trip maps of task 2: one CircleMarker
+# per GPS point (the old scripts) against one GeoJSON layer per trip on a canvas
+# (folium_render.py). Load time is measured in headless Chrome until the map is ready
+# (screenshot_service.load_page) and skipped if selenium cannot start Chrome.
+input_store = './data/train-1500.parquet'
+output_dir = './data/bench_folium'
+trip_counts = [15, 100]
+repeats = 3
+timeout = 60
+colors = ['blue', 'green', 'red', 'purple', 'orange', 'darkred', 'lightred', 'beige', 'darkblue', 'darkgreen']
+
+def marker_map(trip_coords, bounds):
+    (lat_min, lon_min), (lat_max, lon_max) = bounds
+    fmap = folium.Map(location=[(lat_min + lat_max) / 2, (lon_min + lon_max) / 2], zoom_start=13, width=1500, height=1000)
+    fmap.fit_bounds(bounds)
+    for idx, coords in enumerate(trip_coords):
+        color = colors[idx % len(colors)]
+        feature_group = folium.FeatureGroup(name=f'Trip {idx + 1}')
+        for lon, lat in coords.tolist():
+            folium.CircleMarker(location=(lat, lon), radius=3, color=color, fill=True, fill_opacity=1).add_to(feature_group)
+        folium.PolyLine([(lat, lon) for lon, lat in coords.tolist()], color=color, weight=2).add_to(feature_group)
+        fmap.add_child(feature_group)
+    return fmap
+
+def geojson_map(trip_coords, bounds):
+    fmap = trip_map(bounds)
+    return add_trips(fmap, trip_coords, [colors[idx % len(colors)] for idx in range(len(trip_coords))],
+                     [f'Trip {idx + 1}' for idx in range(len(trip_coords))])
+
+driver = None
+try:
+    from screenshot_service import chrome_driver, load_page
+    driver = chrome_driver((1500, 1000))
+except Exception as e:
+    print(f"No headless Chrome ({type(e).__name__}), load times are not measured")
+
+os.makedirs(output_dir, exist_ok=True)
+_, coords, offsets = read_trips(input_store, columns=['TRIP_ID', 'POLYLINE'], limit=max(trip_counts))
+try:
+    for num_trips in trip_counts:
+        trip_coords = split_lists(coords, offsets)[:num_trips]
+        bounds = map_bounds(*trip_coords)
+        print(f"{len(trip_coords)} trips, {sum(len(c) for c in trip_coords)} points")
+        for name, build in [('CircleMarker per point', marker_map), ('GeoJSON layer per trip', geojson_map)]:
+            html_file = os.path.join(output_dir, f"{build.__name__}_{num_trips}.html")
+            start_time = time.perf_counter()
+            build(trip_coords, bounds).save(html_file)
+            write_time = time.perf_counter() - start_time
+            load = ''
+            if driver is not None:
+                load_times = [load_page(driver, html_file, timeout) for _ in range(repeats)]
+                if None in load_times:
+                    load = f" \t not ready after {timeout} s"
+                else:
+                    load = f" \t load {np.median(load_times) * 1000:8.1f} ms"
+            print(f"{name:<24} {os.path.getsize(html_file) / 1024:8.0f} KB \t write {write_time * 1000:7.1f} ms{load}")
+finally:
+    if driver is not None:
+        driver.quit()
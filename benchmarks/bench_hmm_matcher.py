@@ -0,0 +1,72 @@
+import os
+import sys
+import csv
+import json
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from hmm_matcher import HMMMatcher
+from matched_store import MatchedStore
+
+# Speed of the NumPy HMM matcher on the first trips of train-1500.csv and its agreement with
+# the fmm results in fmm_store (written by 03_run.sh, 03_map_matching_hmm.py writes its results to
+# data/matched_store_hmm instead). fmm's speed on the same trips is printed
+# by benchmarks/bench_fmm_session.py inside the fmm Docker image (MatcherSession.match_many).
+network_file = './porto/edges.shp'
+input_file = './data/train-1500.csv'
+fmm_store = './data/matched_store'
+num_trips = 200
+batch_size = 64
+search_radius = 200.0
+k_neighbors = 10
+gps_accuracy = 50.0
+
+start_time = time.perf_counter()
+matcher = HMMMatcher(network_file, k_neighbors, search_radius, gps_accuracy)
+print(f"Network and path table loaded in {time.perf_counter() - start_time:.2f} s ({len(matcher.table)} node pairs)")
+
+with open(input_file, 'r') as csv_input:
+    rows = [row for _, row in zip(range(num_trips), csv.DictReader(csv_input))]
+trip_ids = [int(row['TRIP_ID']) for row in rows]
+trajectories = [json.loads(row['POLYLINE']) for row in rows]
+num_points = sum(len(trajectory) for trajectory in trajectories)
+
+start_time = time.perf_counter()
+results = []
+for start in range(0, len(trajectories), batch_size):
+    results.extend(matcher.match_many(trajectories[start:start + batch_size]))
+elapsed = time.perf_counter() - start_time
+print(f"{len(trajectories)} trips, {num_points} points")
+print(f"{'HMMMatcher.match_many':<28} {elapsed * 1000:9.1f} ms \t {elapsed * 1000 / len(trajectories):7.3f} ms/trip"
+      f" \t {num_points / elapsed:9.0f} points/s")
+print(f"{sum(r is not None and len(r['cpath']) > 0 for r in results)} of {len(results)} trips matched")
+
+if not os.path.exists(fmm_store):
+    print(f"No fmm results in {fmm_store}, run 03_run.sh for the agreement")
+    sys.exit()
+
+# Agreement on the trips both matchers matched: share of GPS points matched to the same edge
+# and overlap (intersection over union) of the edges of the complete paths
+store = MatchedStore(fmm_store)
+row_of_trip = dict(zip(store.trip_ids.tolist(), range(len(store))))
+same_points = compared_points = 0
+overlaps = []
+for trip_id, result in zip(trip_ids, results):
+    row = row_of_trip.get(trip_id)
+    if row is None or result is None or len(result['cpath']) == 0:
+        continue
+    fmm_opath, fmm_cpath = store.get('opath', row), store.get('cpath', row)
+    if len(fmm_cpath) == 0:
+        continue
+    if len(fmm_opath) == len(result['opath']):
+        same_points += int(np.sum(fmm_opath == np.asarray(result['opath'])))
+        compared_points += len(fmm_opath)
+    fmm_edges, hmm_edges = set(fmm_cpath.tolist()), set(result['cpath'])
+    overlaps.append(len(fmm_edges & hmm_edges) / len(fmm_edges | hmm_edges))
+
+print(f"{len(overlaps)} trips matched by both")
+if compared_points:
+    print(f"Points on the same edge: {same_points / compared_points * 100:.1f} %")
+if overlaps:
+    print(f"Path edge overlap: mean {np.mean(overlaps) * 100:.1f} %, median {np.median(overlaps) * 100:.1f} %")
@@ -0,0 +1,44 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import geopandas as gpd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from graph_store import load_graph
+from network_export import FORMATS, export_network
+
+# Write and read time and size of the directional network as shapefile (what
+# 01_download_network.ipynb wrote before network_export.py) against GeoPackage,
+# FlatGeobuf and GeoParquet, for the graphs exported by the notebook
+network_dirs = ['./porto', './stockholm']
+formats = ['shp', 'gpkg', 'fgb', 'parquet']
+repeats = 3
+
+def read_layer(path, fmt):
+    return gpd.read_parquet(path) if fmt == 'parquet' else gpd.read_file(path)
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+for network_dir in network_dirs:
+    if not os.path.exists(os.path.join(network_dir, 'edges.shp')):
+        print(f"Skipping {network_dir}, run 01_download_network.ipynb first")
+        continue
+    G = load_graph(network_dir=network_dir)
+    print(f"{network_dir}: {G.number_of_nodes()} nodes, {G.number_of_edges()} edges")
+    for fmt in formats:
+        extension = FORMATS[fmt][0]
+        write_time = read_time = float('inf')
+        for _ in range(repeats):
+            output_dir = tempfile.mkdtemp()
+            try:
+                write_time = min(write_time, export_network(G, output_dir, formats=(fmt,))[fmt])
+                start_time = time.perf_counter()
+                read_layer(os.path.join(output_dir, 'edges' + extension), fmt)
+                read_time = min(read_time, time.perf_counter() - start_time)
+                size = directory_size(output_dir)
+            finally:
+                shutil.rmtree(output_dir)
+        print(f"{fmt:<10} write {write_time * 1000:9.1f} ms \t read edges {read_time * 1000:9.1f} ms \t {size / 1e6:7.2f} MB")
@@ -0,0 +1,33 @@
+import os
+import sys
+import ast
+import csv
+import json
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from polylines import decode_polylines
+
+# Compare POLYLINE parse throughput of the old per-row paths against decode_polylines
+input_file = './data/train-1500.csv'
+repeats = 3
+
+with open(input_file, 'r') as csvfile:
+    texts = [row['POLYLINE'] for row in csv.DictReader(csvfile)]
+
+num_points = len(decode_polylines(texts)[0])
+parsers = {
+    'eval': lambda: [eval(t) for t in texts],
+    'ast.literal_eval': lambda: [ast.literal_eval(t) for t in texts],
+    'json.loads': lambda: [json.loads(t) for t in texts],
+    'decode_polylines': lambda: decode_polylines(texts),
+}
+
+print(f"{len(texts)} polylines, {num_points} points")
+for name, parse in parsers.items():
+    best = float('inf')
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        parse()
+        best = min(best, time.perf_counter() - start_time)
+    print(f"{name:<20} {best * 1000:9.1f} ms \t {num_points / best / 1e6:6.2f} M points/s")
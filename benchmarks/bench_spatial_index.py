@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from trip_store import read_trips
+from traversal import edge_way_table
+from spatial_index import EdgeIndex, PointGrid
+
+# Build and query times of the spatial indexes: nearest edges of every GPS point (fmm's
+# candidate search), viewport-sized bboxes against a scan of the raw coordinates, also at the
+# size of the full corpus, and the trips touching the way with the most edges
+network_file = './porto/edges.shp'
+input_store = './data/train-1500.parquet'
+k_neighbors = 8
+search_radius = 200.0  # meters
+touch_radius = 30.0  # meters
+num_bbox_queries = 200
+bbox_size = 0.005  # degrees, about 400 x 550 m
+
+# Full-corpus bbox case: the trips of full_corpus_store if 01_take-1500.py wrote it, otherwise the
+# trips of input_store repeated, each copy shifted by up to about 1 km, up to full_corpus_trips
+full_corpus_store = './data/train.parquet'
+full_corpus_trips = 1710670  # trips in train.csv
+num_full_bbox_queries = 20
+
+def timed(name, run, count=None, unit=''):
+    start_time = time.perf_counter()
+    result = run()
+    elapsed = time.perf_counter() - start_time
+    rate = f" \t {count / elapsed:12.0f} {unit}/s" if count else ''
+    print(f"{name:<32} {elapsed * 1000:9.1f} ms{rate}")
+    return result
+
+_, coords, offsets = read_trips(input_store, columns=['TRIP_ID', 'POLYLINE'])
+edge_index = timed('EdgeIndex build', lambda: EdgeIndex.from_file(network_file))
+grid = timed('PointGrid build', lambda: PointGrid(coords, offsets, lat0=edge_index.lat0))
+print(f"{len(edge_index)} edges, {len(edge_index.segment_edge)} segments, {len(offsets) - 1} trips, {len(coords)} points")
+
+candidate_offsets, _, distances, _ = timed(f'{k_neighbors} nearest edges', lambda: edge_index.nearest(
+    coords, k_neighbors, search_radius), len(coords), 'points')
+found = np.diff(candidate_offsets) > 0
+print(f"{np.mean(found) * 100:.1f} % of points have a candidate within {search_radius:.0f} m, "
+      f"median distance to the closest {np.median(distances[candidate_offsets[:-1][found]]):.1f} m")
+
+centers = coords[np.random.default_rng(0).choice(len(coords), num_bbox_queries)]
+bboxes = np.hstack([centers - bbox_size / 2, centers + bbox_size / 2])
+def scan():
+    return [np.flatnonzero((coords[:, 0] >= b[0]) & (coords[:, 1] >= b[1]) & (coords[:, 0] <= b[2]) & (coords[:, 1] <= b[3]))
+            for b in bboxes]
+timed('bbox points (scan)', scan, len(bboxes), 'queries')
+timed('bbox points (grid)', lambda: grid.in_bboxes(bboxes), len(bboxes), 'queries')
+timed('bbox edges (STRtree)', lambda: edge_index.in_bboxes(bboxes), len(bboxes), 'queries')
+
+if os.path.exists('./data/edges_eid_to_osmid.csv'):
+    way_ids, way_offsets = edge_way_table('./data/edges_eid_to_osmid.csv')
+    edge_of_way = np.repeat(np.arange(len(way_offsets) - 1), np.diff(way_offsets))
+    wids, counts = np.unique(way_ids, return_counts=True)
+    wid = wids[np.argmax(counts)]
+    eids = np.unique(edge_of_way[way_ids == wid])
+    touching = timed(f'trips touching way {wid}', lambda: grid.trips_near_segments(*edge_index.edge_segments(eids), touch_radius))
+    print(f"{len(touching)} trips within {touch_radius:.0f} m of the {len(eids)} edges of way {wid}")
+
+if os.path.exists(full_corpus_store):
+    _, coords, offsets = read_trips(full_corpus_store, columns=['TRIP_ID', 'POLYLINE'])
+else:
+    copies = -(-full_corpus_trips // (len(offsets) - 1))
+    shifts = np.random.default_rng(1).uniform(-0.01, 0.01, (copies, 2))
+    coords = (coords[None] + shifts[:, None]).reshape(-1, 2)
+    offsets = np.concatenate([[0], np.cumsum(np.tile(np.diff(offsets), copies))])
+grid = timed('PointGrid build (full size)', lambda: PointGrid(coords, offsets, lat0=edge_index.lat0))
+print(f"{len(offsets) - 1} trips, {len(coords)} points")
+centers = coords[np.random.default_rng(0).choice(len(coords), num_full_bbox_queries)]
+bboxes = np.hstack([centers - bbox_size / 2, centers + bbox_size / 2])
+timed('bbox points (scan, full size)', scan, len(bboxes), 'queries')
+timed('bbox points (grid, full size)', lambda: grid.in_bboxes(bboxes), len(bboxes), 'queries')
@@ -0,0 +1,61 @@
+import os
+import sys
+import math
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from trip_store import read_trips
+from geo import EARTH_RADIUS
+from trajectory_filter import filter_outliers
+
+# Compare the outlier filter of 06_mm_improvement.py as the per-point Python loop over lists it
+# used to be against filter_outliers (numba-compiled if numba is installed), same thresholds
+input_store = './data/train-1500.parquet'
+repeats = 3
+copies = 20  # repeat the trips to get a workload closer to the full dataset
+
+_, coords, offsets = read_trips(input_store, columns=['TRIP_ID', 'POLYLINE'])
+coords = np.tile(coords, (copies, 1))
+offsets = np.concatenate([[0], np.cumsum(np.tile(np.diff(offsets), copies))])
+
+def distance(a, b):
+    lon1, lat1, lon2, lat2 = math.radians(a[0]), math.radians(a[1]), math.radians(b[0]), math.radians(b[1])
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(h))
+
+def python_loop(min_thresh=500.0, max_thresh=10000.0, step_thresh=500.0, noise_thresh=20.0):
+    filtered = []
+    for start, stop in zip(offsets[:-1].tolist(), offsets[1:].tolist()):
+        polyline = coords[start:stop].tolist()
+        if len(polyline) < 2:
+            filtered.append(polyline)
+            continue
+        modified_points = [polyline[0]]
+        last_point, threshold = polyline[0], min_thresh
+        for next_point in polyline[1:]:
+            d = distance(last_point, next_point)
+            if d < threshold and d > noise_thresh:
+                modified_points.append(next_point)
+                last_point, threshold = next_point, min_thresh
+            else:
+                threshold = min(threshold + step_thresh, max_thresh)
+        filtered.append(modified_points)
+    return filtered
+
+filters = {
+    'python loop': python_loop,
+    'filter_outliers': lambda: filter_outliers(coords, offsets),
+}
+
+filter_outliers(coords[:offsets[1]], offsets[:2])  # compile outside of the timing
+print(f"{len(offsets) - 1} trips, {len(coords)} points")
+kept, kept_offsets = filter_outliers(coords, offsets)
+print(f"Same points kept: {np.array_equal(kept, np.array([p for trip in python_loop() for p in trip]).reshape(-1, 2))}")
+for name, run in filters.items():
+    best = float('inf')
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start_time)
+    print(f"{name:<20} {best * 1000:9.1f} ms \t {len(coords) / best / 1e6:6.2f} M points/s")
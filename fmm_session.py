@@ -0,0 +1,64 @@
+import os
+import hashlib
+from fmm import FastMapMatch, FastMapMatchConfig, UBODTGenAlgorithm
+
+# Runs inside the fmm Docker image, keep it Python 2 compatible
+
+# Files of a shapefile that define the network geometry and the fid/u/v attributes
+NETWORK_EXTENSIONS = [".shp", ".shx", ".dbf"]
+
+def trajectory_to_wkt(trajectory):
+    return 'LINESTRING(' + ','.join([' '.join(map(str, point)) for point in trajectory]) + ')'
+
+# Binary UBODT cache keyed by the content of the network shapefile and the distance threshold
+def network_hash(network_file, threshold):
+    digest = hashlib.sha1()
+    base = os.path.splitext(network_file)[0]
+    for extension in NETWORK_EXTENSIONS:
+        if not os.path.exists(base + extension):
+            continue
+        with open(base + extension, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    digest.update(repr(float(threshold)).encode("ascii"))
+    return digest.hexdigest()[:16]
+
+def ubodt_cache_path(network_file, threshold, cache_dir):
+    return os.path.join(cache_dir, "ubodt_{}.bin".format(network_hash(network_file, threshold)))
+
+# Return the cached binary UBODT for this network and threshold, generating it only if missing
+def cached_ubodt(network, graph, network_file, threshold, cache_dir):
+    ubodt_path = ubodt_cache_path(network_file, threshold, cache_dir)
+    if os.path.exists(ubodt_path):
+        print("Using cached UBODT {}.".format(ubodt_path))
+        return ubodt_path
+
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    print("Generating UBODT file {}.".format(ubodt_path))
+    tmp_path = ubodt_path + ".tmp"
+    UBODTGenAlgorithm(network, graph).generate_ubodt(tmp_path, threshold, binary=True, use_omp=True)
+    os.rename(tmp_path, ubodt_path)  # Never leave a half-written table under the cache key
+    return ubodt_path
+
+# FastMapMatch model and configuration built once and reused for every trajectory
+class MatcherSession(object):
+    def __init__(self, network, graph, ubodt, k_neighbors, search_radius, gps_accuracy):
+        self.model = FastMapMatch(network, graph, ubodt)
+        self.config = FastMapMatchConfig(k_neighbors, search_radius, gps_accuracy)
+
+    def match(self, trajectory):
+        return self.model.match_wkt(trajectory_to_wkt(trajectory), self.config)
+
+    # Match a batch of trajectories, failed trajectories give None and are reported in errors
+    def match_many(self, trajectories, errors=None):
+        wkt_paths = [trajectory_to_wkt(trajectory) for trajectory in trajectories]
+        results = []
+        for i, wkt_path in enumerate(wkt_paths):
+            try:
+                results.append(self.model.match_wkt(wkt_path, self.config))
+            except Exception as e:
+                results.append(None)
+                if errors is not None:
+                    errors.append((i, e))
+        return results
@@ -0,0 +1,57 @@
+import os
+import time
+import numpy as np
+import folium
+
+# Shared folium rendering for the trip maps of tasks 2, 4 and 6. Every trip is one GeoJSON
+# layer (a MultiPoint of its GPS points plus a LineString of its route) instead of one
+# CircleMarker per point, and maps draw vectors on a single canvas (prefer_canvas).
+
+MARGIN = 0.005  # degrees around the trips
+
+# [[lat_min, lon_min], [lat_max, lon_max]] of all points (M x 2 lon/lat arrays) plus the margin
+def map_bounds(*coords, margin=MARGIN):
+    points = np.concatenate([np.asarray(c, dtype=np.float64).reshape(-1, 2) for c in coords])
+    lon_min, lat_min = points.min(axis=0) - margin
+    lon_max, lat_max = points.max(axis=0) + margin
+    return [[lat_min, lon_min], [lat_max, lon_max]]
+
+def trip_map(bounds, width=1500, height=1000, **kwargs):
+    (lat_min, lon_min), (lat_max, lon_max) = bounds
+    fmap = folium.Map(location=[(lat_min + lat_max) / 2, (lon_min + lon_max) / 2], zoom_start=13,
+                      width=width, height=height, prefer_canvas=True, **kwargs)
+    fmap.fit_bounds(bounds)
+    return fmap
+
+def trip_geojson(coords):
+    coords = np.asarray(coords, dtype=np.float64).tolist()
+    features = [{'type': 'Feature', 'properties': {}, 'geometry': {'type': 'MultiPoint', 'coordinates': coords}}]
+    if len(coords) > 1:
+        features.append({'type': 'Feature', 'properties': {}, 'geometry': {'type': 'LineString', 'coordinates': coords}})
+    return {'type': 'FeatureCollection', 'features': features}
+
+# One GeoJSON layer with the points and the route of a trip
+def trip_layer(coords, color, radius=3, weight=2, opacity=1.0, tooltip=None):
+    style = {'color': color, 'weight': weight, 'opacity': opacity, 'fillColor': color, 'fillOpacity': 1}
+    return folium.GeoJson(trip_geojson(coords),
+                          style_function=lambda feature: style,
+                          marker=folium.CircleMarker(radius=radius, fill=True),
+                          tooltip=tooltip)
+
+# Add each trip as its own toggleable feature group, tooltips (one per trip) are shown on hover
+def add_trips(fmap, trip_coords, colors, names, tooltips=None, **kwargs):
+    if tooltips is None:
+        tooltips = [None] * len(trip_coords)
+    for coords, color, name, tooltip in zip(trip_coords, colors, names, tooltips):
+        feature_group = folium.FeatureGroup(name=name)
+        trip_layer(coords, color, tooltip=tooltip, **kwargs).add_to(feature_group)
+        fmap.add_child(feature_group)
+    return fmap
+
+# Save the map and report the HTML size and the time Python took to write it. Its load time
+# in the browser is measured by benchmarks/bench_folium_render.py (screenshot_service.load_page).
+def save_map(fmap, filename):
+    start_time = time.perf_counter()
+    fmap.save(filename)
+    elapsed = time.perf_counter() - start_time
+    print(f"Map saved as {filename} (HTML {os.path.getsize(filename) / 1024:.0f} KB, written in {elapsed:.2f} s)")
@@ -0,0 +1,9 @@
+import numpy as np
+
+EARTH_RADIUS = 6371008.8  # mean earth radius in meters
+
+# Great-circle distance in meters, element-wise for arrays of lon/lat degrees
+def haversine(lon1, lat1, lon2, lat2):
+    lon1, lat1, lon2, lat2 = map(np.radians, (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
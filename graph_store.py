@@ -0,0 +1,113 @@
+import os
+import time
+import pickle
+import hashlib
+import numpy as np
+import osmnx as ox
+import geopandas as gpd
+
+# Road graph cache for the osmnx scripts. Graphs are pickled once under a content key and
+# loaded from there in milliseconds, instead of geocoding and downloading the network with
+# graph_from_place on every run. With the shapefiles of 01_download_network.ipynb in
+# NETWORK_DIR the graph is built from them, so no network access is needed at all.
+
+GRAPH_STORE_DIR = './data/graph_store'
+NETWORK_DIR = './porto'
+PLACE = "Porto, Portugal"
+NETWORK_TYPE = 'drive'
+WHICH_RESULT = 2
+GRAPH_OFFLINE = False  # raise instead of downloading when neither the store nor the shapefiles have the graph
+
+SHAPEFILE_EXTENSIONS = ['.shp', '.shx', '.dbf']
+
+# Key of a downloaded graph: the query plus the osmnx version that built it
+def place_key(place, network_type, which_result):
+    query = repr((place, network_type, which_result, ox.__version__))
+    return hashlib.sha1(query.encode()).hexdigest()[:16]
+
+# Key of a graph built from shapefiles: the content of the nodes and edges files
+def shapefile_key(directory):
+    digest = hashlib.sha1()
+    for name in ['nodes', 'edges']:
+        for extension in SHAPEFILE_EXTENSIONS:
+            path = os.path.join(directory, name + extension)
+            if not os.path.exists(path):
+                continue
+            digest.update((name + extension).encode())
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+    return digest.hexdigest()[:16]
+
+def store_path(store_dir, name, key):
+    return os.path.join(store_dir, f"{name}_{key}.pickle")
+
+def read_graph(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+def write_graph(G, path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(G, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)  # Never leave a half-written graph under the key
+
+# Graph of the directional shapefiles written by network_export.export_network. Without
+# nodes.shp the nodes are taken from the first and last points of the edge geometries.
+def graph_from_shapefiles(directory):
+    gdf_edges = gpd.read_file(os.path.join(directory, 'edges.shp'))
+    if 'key' not in gdf_edges.columns:
+        gdf_edges['key'] = gdf_edges.groupby(['u', 'v']).cumcount()
+    gdf_edges = gdf_edges.set_index(['u', 'v', 'key'])
+
+    nodes_file = os.path.join(directory, 'nodes.shp')
+    if os.path.exists(nodes_file):
+        gdf_nodes = gpd.read_file(nodes_file).set_index('osmid')
+    else:
+        u = gdf_edges.index.get_level_values('u').to_numpy()
+        v = gdf_edges.index.get_level_values('v').to_numpy()
+        first = np.array([line.coords[0] for line in gdf_edges.geometry])
+        last = np.array([line.coords[-1] for line in gdf_edges.geometry])
+        osmid, rows = np.unique(np.concatenate([u, v]), return_index=True)
+        xy = np.concatenate([first, last])[rows]
+        gdf_nodes = gpd.GeoDataFrame({'x': xy[:, 0], 'y': xy[:, 1]},
+                                     geometry=gpd.points_from_xy(xy[:, 0], xy[:, 1]),
+                                     index=osmid, crs=gdf_edges.crs)
+        gdf_nodes.index.name = 'osmid'
+    return ox.graph_from_gdfs(gdf_nodes, gdf_edges)
+
+def timed_load(path):
+    start_time = time.perf_counter()
+    G = read_graph(path)
+    print(f"Loaded graph {path} in {(time.perf_counter() - start_time) * 1000:.0f} ms")
+    return G
+
+# Download a place once and keep it in the store
+def download_graph(place=PLACE, network_type=NETWORK_TYPE, which_result=WHICH_RESULT, store_dir=GRAPH_STORE_DIR):
+    path = store_path(store_dir, 'place', place_key(place, network_type, which_result))
+    if os.path.exists(path):
+        return timed_load(path)
+    if GRAPH_OFFLINE:
+        raise KeyError(f"Graph of {place} not in {store_dir} and GRAPH_OFFLINE is set")
+    print(f"Downloading graph of {place}")
+    G = ox.graph_from_place(place, network_type=network_type, which_result=which_result)
+    write_graph(G, path)
+    return G
+
+# The road graph for all scripts: from the shapefiles in network_dir if they exist,
+# otherwise downloaded, cached in the store either way
+def load_graph(place=PLACE, network_type=NETWORK_TYPE, which_result=WHICH_RESULT,
+               network_dir=NETWORK_DIR, store_dir=GRAPH_STORE_DIR):
+    if network_dir is None or not os.path.exists(os.path.join(network_dir, 'edges.shp')):
+        return download_graph(place, network_type, which_result, store_dir)
+
+    name = os.path.basename(os.path.normpath(network_dir))
+    path = store_path(store_dir, name, shapefile_key(network_dir))
+    if os.path.exists(path):
+        return timed_load(path)
+    print(f"Building graph from the shapefiles in {network_dir}")
+    G = graph_from_shapefiles(network_dir)
+    write_graph(G, path)
+    return G
@@ -0,0 +1,250 @@
+import os
+import shutil
+import hashlib
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from spatial_index import EdgeIndex, edge_polylines, project, read_edge_file
+from ragged import expand
+from matched_store import RAGGED_COLUMNS
+
+# Batch HMM map matcher in NumPy, a fallback for the fmm Docker image that follows fmm's model:
+# up to k candidate edges within the search radius of every GPS point, emission probability
+# exp(-(error / gps_accuracy)^2 / 2), transition probability min(eu, sp) / max(eu, sp) of the
+# straight and the network distance between consecutive candidates, and Viterbi over the log
+# probabilities. Network distances come from a table of all node pairs within delta meters
+# (fmm's UBODT), built once per network and memory-mapped by every worker.
+# Results have the columns of fmm's MatchResult, with all distances in meters (fmm reports
+# them in the units of the network file, degrees for porto/edges.shp). Edge ids are the rows
+# of the network file, which is the fid written by network_export.py.
+
+PATH_TABLE_FILES = ['keys', 'distance', 'last_edge']
+PATH_TABLE_CHUNK = 256  # Dijkstra sources per batch while building the table
+NETWORK_EXTENSIONS = ['.shp', '.shx', '.dbf']
+
+# Table key of the network content and the distance bound
+def network_key(network_file, delta):
+    digest = hashlib.sha1()
+    base, extension = os.path.splitext(network_file)
+    for part in (NETWORK_EXTENSIONS if extension == '.shp' else [extension]):
+        if not os.path.exists(base + part):
+            continue
+        with open(base + part, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    digest.update(repr(float(delta)).encode('ascii'))
+    return digest.hexdigest()[:16]
+
+# Shortest network distances from every node to all nodes within delta meters and the last edge
+# of each path, as arrays sorted by source * num_nodes + target (16 bytes per pair). Of parallel
+# edges the shortest is used.
+def build_path_table(source, target, length, num_nodes, delta, directory):
+    order = np.lexsort((length, target, source))
+    pair_keys = source[order] * num_nodes + target[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = pair_keys[1:] != pair_keys[:-1]
+    kept, pair_keys = order[first], pair_keys[first]
+    graph = csr_matrix((np.maximum(length[kept], 1e-6), (source[kept], target[kept])), shape=(num_nodes, num_nodes))
+
+    keys, distances, last_edges = [], [], []
+    for start in range(0, num_nodes, PATH_TABLE_CHUNK):
+        sources = np.arange(start, min(start + PATH_TABLE_CHUNK, num_nodes))
+        dist, predecessors = dijkstra(graph, indices=sources, limit=delta, return_predecessors=True)
+        rows, targets = np.nonzero(np.isfinite(dist))
+        previous = predecessors[rows, targets].astype(np.int64)
+        last_edge = np.full(len(rows), -1, dtype=np.int64)  # -1 for the source itself
+        via = previous >= 0
+        last_edge[via] = kept[np.searchsorted(pair_keys, previous[via] * num_nodes + targets[via])]
+        keys.append(sources[rows] * num_nodes + targets)
+        distances.append(dist[rows, targets].astype(np.float32))
+        last_edges.append(last_edge.astype(np.int32))
+
+    os.makedirs(directory)
+    np.save(os.path.join(directory, 'keys.npy'), np.concatenate(keys))
+    np.save(os.path.join(directory, 'distance.npy'), np.concatenate(distances))
+    np.save(os.path.join(directory, 'last_edge.npy'), np.concatenate(last_edges))
+    np.save(os.path.join(directory, 'num_nodes.npy'), np.array([num_nodes], dtype=np.int64))
+
+class PathTable:
+    def __init__(self, directory):
+        self.keys, self.distance, self.last_edge = [np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+                                                    for name in PATH_TABLE_FILES]
+        self.num_nodes = int(np.load(os.path.join(directory, 'num_nodes.npy'))[0])
+
+    def __len__(self):
+        return len(self.keys)
+
+    # Rows of the node pairs, -1 for pairs further apart than delta
+    def rows_of(self, sources, targets):
+        keys = np.asarray(sources, dtype=np.int64) * self.num_nodes + np.asarray(targets, dtype=np.int64)
+        rows = np.searchsorted(self.keys, keys)
+        found = rows < len(self.keys)
+        found[found] = self.keys[rows[found]] == keys[found]
+        return np.where(found, rows, -1)
+
+    def distances(self, sources, targets):
+        rows = self.rows_of(sources, targets)
+        return np.where(rows >= 0, self.distance[np.maximum(rows, 0)], np.inf)
+
+    # Edges of the shortest path between two nodes of the table, edge_source[e] is the start node of e.
+    # Raises KeyError for pairs that are not in the table (farther apart than delta or unreachable).
+    def path(self, source, target, edge_source):
+        edges = []
+        while target != source:
+            row = self.rows_of([source], [target])[0]
+            if row < 0:
+                raise KeyError((source, target))
+            edge = int(self.last_edge[row])
+            edges.append(edge)
+            target = edge_source[edge]
+        return edges[::-1]
+
+# The table of this network and delta, built only if missing
+def cached_path_table(network_file, source, target, length, num_nodes, delta, cache_dir):
+    directory = os.path.join(cache_dir, 'path_table_{}'.format(network_key(network_file, delta)))
+    if os.path.exists(directory):
+        print(f"Using cached path table {directory}.")
+        return PathTable(directory)
+    print(f"Generating path table {directory}.")
+    tmp_directory = directory + '.tmp'
+    if os.path.exists(tmp_directory):
+        shutil.rmtree(tmp_directory)
+    build_path_table(source, target, length, num_nodes, delta, tmp_directory)
+    os.rename(tmp_directory, directory)  # Never leave a half-written table under the cache key
+    return PathTable(directory)
+
+def empty_result():
+    return {name: [] for name, _ in RAGGED_COLUMNS}
+
+class HMMMatcher:
+    def __init__(self, network_file, k_neighbors=10, search_radius=200.0, gps_accuracy=50.0,
+                 delta=2000.0, cache_dir='./data/path_table_cache'):
+        edges = read_edge_file(network_file)
+        self.index = EdgeIndex(*edge_polylines(edges))
+        self.node_ids, ends = np.unique(np.concatenate([edges['u'].to_numpy(dtype=np.int64),
+                                                        edges['v'].to_numpy(dtype=np.int64)]), return_inverse=True)
+        self.source, self.target = ends[:len(edges)], ends[len(edges):]
+        self.table = cached_path_table(network_file, self.source, self.target, self.index.edge_length,
+                                       len(self.node_ids), delta, cache_dir)
+        self.k_neighbors = k_neighbors
+        self.search_radius = search_radius
+        self.gps_accuracy = gps_accuracy
+
+    # Network distance from position p1 on edge e1 to position p2 on edge e2, inf beyond delta
+    def network_distances(self, e1, p1, e2, p2):
+        node_distances = self.table.distances(self.target[e1], self.source[e2])
+        through_nodes = node_distances + (self.index.edge_length[e1] - p1) + p2
+        return np.where((e1 == e2) & (p1 <= p2), p2 - p1, through_nodes)
+
+    @staticmethod
+    def transition_probabilities(eu, sp):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(eu >= sp, (sp + 1e-6) / (eu + 1e-6), eu / sp)
+
+    # Candidate of every point on the most likely path or None if the points cannot be
+    # connected. candidates are (offsets, eids, errors, positions) of EdgeIndex.nearest.
+    def viterbi(self, xy, candidates):
+        offsets, eids, errors, positions = candidates
+        counts = np.diff(offsets)
+        num_points = len(counts)
+        if num_points == 0 or np.any(counts == 0):
+            return None
+        log_ep = -0.5 * (errors / self.gps_accuracy) ** 2
+
+        # all candidate pairs of consecutive points at once, pair block t is counts[t] x counts[t + 1]
+        sizes = counts[:-1] * counts[1:]
+        pair_offsets = np.zeros(num_points, dtype=np.int64)
+        np.cumsum(sizes, out=pair_offsets[1:])
+        layer = np.repeat(np.arange(num_points - 1), sizes)
+        local = np.arange(pair_offsets[-1]) - pair_offsets[layer]
+        i = offsets[layer] + local // counts[layer + 1]
+        j = offsets[layer + 1] + local % counts[layer + 1]
+        sp = self.network_distances(eids[i], positions[i], eids[j], positions[j])
+        eu = np.hypot(*np.diff(xy, axis=0).T)[layer]
+        with np.errstate(divide='ignore'):
+            log_tp = np.log(self.transition_probabilities(eu, sp))
+
+        score = log_ep[offsets[0]:offsets[1]]
+        back = np.zeros(len(eids), dtype=np.int64)
+        for t in range(num_points - 1):
+            block = log_tp[pair_offsets[t]:pair_offsets[t + 1]].reshape(counts[t], counts[t + 1]) + score[:, None]
+            best = np.argmax(block, axis=0)
+            score = block[best, np.arange(counts[t + 1])] + log_ep[offsets[t + 1]:offsets[t + 2]]
+            if not np.any(np.isfinite(score)):
+                return None  # no candidate of point t + 1 is reachable, fmm gives no match either
+            back[offsets[t + 1]:offsets[t + 2]] = offsets[t] + best
+
+        chosen = np.zeros(num_points, dtype=np.int64)
+        chosen[-1] = offsets[-2] + np.argmax(score)
+        for t in range(num_points - 1, 0, -1):
+            chosen[t - 1] = back[chosen[t]]
+        return chosen
+
+    # Matched geometry along cpath from the first to the last matched position
+    def path_geometry(self, cpath, first_position, last_position):
+        if len(cpath) == 1:
+            return self.index.edge_slice(cpath[0], first_position, last_position)
+        # the edges in between in full, without their first point which ends the edge before
+        middle = np.asarray(cpath[1:-1], dtype=np.int64)
+        points, _ = expand(self.index.offsets[middle] + 1, self.index.offsets[middle + 1])
+        return np.concatenate([self.index.edge_slice(cpath[0], first_position), self.index.coords[points],
+                               self.index.edge_slice(cpath[-1], 0.0, last_position)[1:]])
+
+    def result(self, xy, candidates, chosen):
+        _, eids, errors, positions = candidates
+        e, p = eids[chosen], positions[chosen]
+        cpath, indices = [int(e[0])], [0]
+        for t in range(1, len(chosen)):
+            if e[t] != e[t - 1] or p[t] < p[t - 1]:
+                cpath.extend(self.table.path(self.target[e[t - 1]], self.source[e[t]], self.source))
+                cpath.append(int(e[t]))
+            indices.append(len(cpath) - 1)
+
+        spdist = np.zeros(len(chosen))
+        tp = np.zeros(len(chosen))
+        spdist[1:] = self.network_distances(e[:-1], p[:-1], e[1:], p[1:])
+        tp[1:] = self.transition_probabilities(np.hypot(*np.diff(xy, axis=0).T), spdist[1:])
+        return {'cpath': cpath,
+                'opath': e.tolist(),
+                'indices': indices,
+                'edge_id': e.tolist(),
+                'source': self.node_ids[self.source[e]].tolist(),
+                'target': self.node_ids[self.target[e]].tolist(),
+                'error': errors[chosen].tolist(),
+                'length': self.index.edge_length[e].tolist(),
+                'offset': p.tolist(),
+                'spdist': spdist.tolist(),
+                'ep': np.exp(-0.5 * (errors[chosen] / self.gps_accuracy) ** 2).tolist(),
+                'tp': tp.tolist(),
+                'mgeom': self.path_geometry(cpath, p[0], p[-1]).ravel().tolist(),
+                'pgeom': self.index.locate(e, p).ravel().tolist(),
+                }
+
+    # Match a batch of trajectories (lists of [lon, lat]). The candidates of all points of the
+    # batch are looked up in one query. Trajectories that cannot be matched give empty results,
+    # like MatcherSession.match_many a trajectory that raises gives None and, if errors is a
+    # list, appends (its index, the exception) to it.
+    def match_many(self, trajectories, errors=None):
+        coords = [np.asarray(trajectory, dtype=np.float64).reshape(-1, 2) for trajectory in trajectories]
+        point_offsets = np.zeros(len(coords) + 1, dtype=np.int64)
+        np.cumsum([len(c) for c in coords], out=point_offsets[1:])
+        all_coords = np.concatenate(coords) if coords else np.zeros((0, 2))
+        offsets, eids, distances, positions = self.index.nearest(all_coords, self.k_neighbors, self.search_radius)
+        xy = project(all_coords, self.index.lat0)
+
+        results = []
+        for trip in range(len(coords)):
+            start, stop = point_offsets[trip], point_offsets[trip + 1]
+            first, last = offsets[start], offsets[stop]
+            candidates = (offsets[start:stop + 1] - first, eids[first:last], distances[first:last], positions[first:last])
+            try:
+                chosen = self.viterbi(xy[start:stop], candidates)
+                results.append(empty_result() if chosen is None else self.result(xy[start:stop], candidates, chosen))
+            except Exception as e:
+                results.append(None)
+                if errors is not None:
+                    errors.append((trip, e))
+        return results
+
+    def match(self, trajectory):
+        return self.match_many([trajectory])[0]
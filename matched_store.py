@@ -0,0 +1,270 @@
+import os
+import csv
+import uuid
+import struct
+import multiprocessing
+
+# The writer runs inside the fmm Docker image (Python 2, no numpy), the readers
+# run in the analysis stages
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Typed store of map-matching results, one directory with one little-endian binary
+# file per column. Per-trip columns hold one value per matched trip, ragged columns
+# hold all values of all trips back to back and lengths.i8 holds, for every trip,
+# the number of entries of each ragged column (geometry lengths count points).
+# Geometries (mgeom, pgeom) are flat lon/lat float64 pairs rather than WKB: the writer runs
+# in the fmm image, which has no shapely, and readers get M x 2 views without any parsing
+# (shapely.from_ragged_array turns them into geometries in bulk where needed).
+# run_id holds a random id written whenever the store is started over, so readers that
+# absorb it incrementally tell a rewritten store from one that was appended to.
+TRIP_COLUMNS = [("idx", "q"), ("id", "q")]
+RAGGED_COLUMNS = [("cpath", "q"),
+                  ("opath", "q"),
+                  ("indices", "q"),
+                  ("edge_id", "q"),
+                  ("source", "q"),
+                  ("target", "q"),
+                  ("error", "d"),
+                  ("length", "d"),
+                  ("offset", "d"),
+                  ("spdist", "d"),
+                  ("ep", "d"),
+                  ("tp", "d"),
+                  ("mgeom", "d"),
+                  ("pgeom", "d"),
+                  ]
+GEOMETRY_COLUMNS = ["mgeom", "pgeom"]
+FILES = TRIP_COLUMNS + [("lengths", "q")] + RAGGED_COLUMNS
+EXTENSIONS = {"q": ".i8", "d": ".f8"}
+RUN_ID_FILE = "run_id"
+
+def _path(directory, name, code):
+    return os.path.join(directory, name + EXTENSIONS[code])
+
+def _geometry_coords(geometry):
+    coords = []
+    for i in range(geometry.get_num_points()):
+        coords.append(geometry.get_x(i))
+        coords.append(geometry.get_y(i))
+    return coords
+
+# Plain (picklable) record of one fmm MatchResult, built in the matching workers
+def match_record(row_index, trip_id, match_result):
+    candidates = match_result.candidates
+    values = {"cpath": list(match_result.cpath),
+              "opath": list(match_result.opath),
+              "indices": list(match_result.indices),
+              "mgeom": _geometry_coords(match_result.mgeom),
+              "pgeom": _geometry_coords(match_result.pgeom),
+              }
+    for name, _ in RAGGED_COLUMNS:
+        if name not in values:
+            values[name] = [getattr(c, name) for c in candidates]
+    return values_record(row_index, trip_id, values)
+
+# Match record of a dict with a list of values for every ragged column, e.g. from hmm_matcher.py
+def values_record(row_index, trip_id, values):
+    return row_index, int(trip_id), [list(values[name]) for name, _ in RAGGED_COLUMNS]
+
+# Appends match records to the store. sizes (from MatchCheckpoint.output_sizes) resumes
+# a previous run by truncating every file back to its committed size.
+class MatchedStoreWriter(object):
+    def __init__(self, directory, sizes=None):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.files = {}
+        for i, (name, code) in enumerate(FILES):
+            path = _path(directory, name, code)
+            if sizes is None:
+                f = open(path, "wb")
+            else:
+                f = open(path, "r+b")
+                f.truncate(sizes[i])
+                f.seek(sizes[i])
+            self.files[name] = f
+        if sizes is None:
+            with open(os.path.join(directory, RUN_ID_FILE), "w") as f:
+                f.write(uuid.uuid4().hex)
+
+    def _write(self, name, code, values):
+        if values:
+            self.files[name].write(struct.pack("<{}{}".format(len(values), code), *values))
+
+    def write(self, record):
+        row_index, trip_id, ragged = record
+        self._write("idx", "q", [row_index])
+        self._write("id", "q", [trip_id])
+        lengths = []
+        for (name, code), values in zip(RAGGED_COLUMNS, ragged):
+            self._write(name, code, values)
+            lengths.append(len(values) // 2 if name in GEOMETRY_COLUMNS else len(values))
+        self._write("lengths", "q", lengths)
+
+    def sync(self):
+        sizes = []
+        for name, _ in FILES:
+            f = self.files[name]
+            f.flush()
+            os.fsync(f.fileno())
+            sizes.append(f.tell())
+        return sizes
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# Record of a resumable matching run. Every commit first makes the output durable via
+# output.sync(), which returns the size of each output file, and then appends
+# "<size>,<size>,... <trip id> ..." to the checkpoint file. On restart the output is
+# truncated back to the last committed sizes, which drops results of trips written
+# after the last commit, and the committed trips are skipped.
+class MatchCheckpoint(object):
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        self.output_sizes = None
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                lines = f.read().split("\n")
+            for line in lines[:-1]:  # The last entry is empty or an incomplete line
+                fields = line.split()
+                if fields:
+                    self.output_sizes = [int(size) for size in fields[0].split(",")]
+                    self.done.update(fields[1:])
+
+    def reset(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.done = set()
+        self.output_sizes = None
+
+    def commit(self, output, trip_ids):
+        self.output_sizes = output.sync()
+        with open(self.path, "a") as f:
+            f.write("{} {}\n".format(",".join(map(str, self.output_sizes)), " ".join(trip_ids)))
+            f.flush()
+            os.fsync(f.fileno())
+        self.done.update(trip_ids)
+
+def _iter_batches(csv_reader, trip_id_index, polyline_index, done_trip_ids, trip_limit, batch_size):
+    batch = []
+    for row_index, row in enumerate(csv_reader):
+        if trip_limit is not None and row_index >= trip_limit:
+            print("Limit of {} trips reached.".format(trip_limit))
+            break
+        if row[trip_id_index] in done_trip_ids:
+            continue
+        batch.append((row_index, row[trip_id_index], row[polyline_index]))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# Matching run of the 03 scripts: matches the trips (TRIP_ID, POLYLINE) of the CSV input_file into
+# the store output_dir in batches of batch_size rows, committing to checkpoint_file every
+# checkpoint_interval trips. match_batch takes a list of (row index, trip id, polyline) and returns
+# the ids of the trips it matched and their match records; trips it leaves out are not committed,
+# so a resumed run retries them. With resume = False, or without output_dir, the run starts over.
+# initializer(*initargs) builds the matcher once per worker process, or once in this process
+# with num_workers = 1.
+def run_matching(match_batch, input_file, output_dir, checkpoint_file, trip_limit=None, batch_size=8,
+                 num_workers=1, resume=True, checkpoint_interval=256, initializer=None, initargs=()):
+    checkpoint = MatchCheckpoint(checkpoint_file)
+    if not resume or not os.path.exists(output_dir):
+        checkpoint.reset()
+    elif checkpoint.done:
+        print("Resuming, {} trips already processed.".format(len(checkpoint.done)))
+
+    with open(input_file, "r") as csv_input, MatchedStoreWriter(output_dir, checkpoint.output_sizes) as output:
+        print("Opened input file and output store.")
+        csv_reader = csv.reader(csv_input)
+        headers = next(csv_reader)
+        trip_id_index = headers.index("TRIP_ID")
+        polyline_index = headers.index("POLYLINE")
+
+        print("Processing rows for map matching.")
+        batches = _iter_batches(csv_reader, trip_id_index, polyline_index, checkpoint.done, trip_limit, batch_size)
+        pool = None
+        if num_workers > 1:
+            # imap returns the batches in input order, so rows are written in idx order
+            pool = multiprocessing.Pool(num_workers, initializer=initializer, initargs=initargs)
+            results = pool.imap(match_batch, batches)
+        else:
+            if initializer is not None:
+                initializer(*initargs)
+            results = (match_batch(batch) for batch in batches)
+
+        try:
+            num_matched = 0
+            pending_trip_ids = []
+            for trip_ids, records in results:
+                for record in records:
+                    output.write(record)
+                num_matched += len(records)
+                pending_trip_ids.extend(trip_ids)
+                if len(pending_trip_ids) >= checkpoint_interval:
+                    checkpoint.commit(output, pending_trip_ids)
+                    pending_trip_ids = []
+                    print("Matched {} trips.".format(num_matched))
+            if pending_trip_ids:
+                checkpoint.commit(output, pending_trip_ids)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+    return num_matched
+
+def _load(directory, name, code):
+    dtype = np.dtype("<i8" if code == "q" else "<f8")
+    path = _path(directory, name, code)
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r")
+
+# Zero-parse reader, every column is a memory-mapped numpy array
+class MatchedStore(object):
+    def __init__(self, directory):
+        self.directory = directory
+        self.idx = _load(directory, "idx", "q")
+        self.trip_ids = _load(directory, "id", "q")
+        self.run_id = None  # stores written before run ids have none
+        if os.path.exists(os.path.join(directory, RUN_ID_FILE)):
+            with open(os.path.join(directory, RUN_ID_FILE), "r") as f:
+                self.run_id = f.read().strip()
+        lengths = _load(directory, "lengths", "q").reshape(-1, len(RAGGED_COLUMNS))
+        self.offsets = {}
+        for i, (name, _) in enumerate(RAGGED_COLUMNS):
+            offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+            np.cumsum(lengths[:, i], out=offsets[1:])
+            self.offsets[name] = offsets
+
+    def __len__(self):
+        return len(self.trip_ids)
+
+    # Flat values and offsets of a ragged column (geometries as M x 2 lon/lat)
+    def ragged(self, name):
+        code = dict(RAGGED_COLUMNS)[name]
+        values = _load(self.directory, name, code)
+        if name in GEOMETRY_COLUMNS:
+            values = values.reshape(-1, 2)
+        return values, self.offsets[name]
+
+    def get(self, name, row):
+        values, offsets = self.ragged(name)
+        return values[offsets[row]:offsets[row + 1]]
+
+    def row_of(self, trip_id):
+        rows = np.flatnonzero(self.trip_ids == int(trip_id))
+        if len(rows) == 0:
+            raise KeyError(trip_id)
+        return int(rows[0])
@@ -0,0 +1,68 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+import osmnx as ox
+
+# Export of a directional road graph for fmm and the analysis scripts. Next to the ESRI
+# shapefile fmm reads, the network can be written as GeoPackage, GeoParquet or FlatGeobuf:
+# these are faster to write and read, have no 2 GB limit and keep full column names and
+# full osmid lists (shapefile text fields stop at 254 characters). The eid -> osmid mapping
+# of 05_route_analysis.py is written from the same edges, so no second read is needed.
+
+FORMATS = {
+    'shp': ('.shp', 'ESRI Shapefile'),
+    'gpkg': ('.gpkg', 'GPKG'),
+    'fgb': ('.fgb', 'FlatGeobuf'),
+    'parquet': ('.parquet', None),
+}
+
+# Every non-numeric column besides the geometry as strings (lists as "[1, 2]", missing
+# values as ""), so columns mixing ints, strings and lists can be written to every format
+def stringify_nonnumeric(gdf):
+    gdf = gdf.copy()
+    for column in gdf.columns:
+        if column != gdf.geometry.name and not pd.api.types.is_numeric_dtype(gdf[column]):
+            gdf[column] = gdf[column].fillna('').astype(str)
+    return gdf
+
+# Nodes and edges with non-numeric columns as strings and the edge id fmm reports (fid)
+# equal to the row of the edge, which is the eid of the mapping
+def directional_gdfs(G):
+    gdf_nodes, gdf_edges = ox.graph_to_gdfs(G)
+    gdf_edges = gdf_edges.reset_index()
+    gdf_edges['fid'] = np.arange(len(gdf_edges))
+    return stringify_nonnumeric(gdf_nodes), stringify_nonnumeric(gdf_edges)
+
+def write_layer(gdf, path, fmt, encoding='utf-8'):
+    if fmt == 'parquet':
+        gdf.to_parquet(path)
+    elif fmt == 'shp':
+        gdf.to_file(path, driver=FORMATS[fmt][1], encoding=encoding)
+    elif fmt == 'gpkg':
+        # GeoPackage would take a fid column as its feature id, keep ours as a plain column
+        gdf.to_file(path, driver=FORMATS[fmt][1], layer_options={'FID': 'gpkg_fid'})
+    else:
+        # Without the packed spatial index FlatGeobuf keeps the rows in order, so row = eid
+        gdf.to_file(path, driver=FORMATS[fmt][1], layer_options={'SPATIAL_INDEX': 'NO'})
+
+# Write nodes and edges of G to filepath in every format and the eid -> osmid mapping to
+# mapping_file. Returns the seconds spent writing each format.
+def export_network(G, filepath, formats=('shp', 'gpkg'), mapping_file=None):
+    os.makedirs(filepath, exist_ok=True)
+    gdf_nodes, gdf_edges = directional_gdfs(G)
+
+    timings = {}
+    for fmt in formats:
+        extension = FORMATS[fmt][0]
+        start_time = time.perf_counter()
+        write_layer(gdf_nodes, os.path.join(filepath, 'nodes' + extension), fmt)
+        write_layer(gdf_edges, os.path.join(filepath, 'edges' + extension), fmt)
+        timings[fmt] = time.perf_counter() - start_time
+
+    if mapping_file is not None:
+        directory = os.path.dirname(mapping_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        gdf_edges[['osmid']].to_csv(mapping_file, index=False)
+    return timings
@@ -0,0 +1,73 @@
+import numpy as np
+
+# Characters that only delimit lists in POLYLINE / match_path / osmid strings
+_LIST_CHARS = str.maketrans('[]()', '    ')
+
+# Decode a column of list strings ("[1, 2]", "(1, 2)", "[[x, y], ...]", "3") into a
+# flat value buffer plus offsets: the values of row i are values[offsets[i]:offsets[i + 1]]
+def decode_lists(texts, dtype=np.float64):
+    texts = [t if isinstance(t, str) and t.strip(' []()') else '' for t in texts]
+    counts = np.fromiter((t.count(',') + 1 if t else 0 for t in texts), dtype=np.int64, count=len(texts))
+    offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    body = ','.join(t for t in texts if t).translate(_LIST_CHARS)
+    values = np.fromstring(body, dtype=dtype, sep=',') if body else np.empty(0, dtype=dtype)
+    if len(values) != offsets[-1]:
+        raise ValueError(f"Malformed list string: parsed {len(values)} values, expected {offsets[-1]}")
+    return values, offsets
+
+def decode_int_lists(texts):
+    return decode_lists(texts, np.int64)
+
+# Decode a column of POLYLINE strings into coords (M x 2, lon/lat) and offsets (n + 1)
+def decode_polylines(texts):
+    values, offsets = decode_lists(texts, np.float64)
+    if np.any(offsets % 2):
+        raise ValueError("POLYLINE string with an odd number of coordinates")
+    return values.reshape(-1, 2), offsets // 2
+
+# Decode a column of WKT LINESTRINGs (e.g. fmm's match_geom) into coords and offsets
+def decode_linestrings(texts):
+    texts = [','.join(t.replace('LINESTRING', '').replace('EMPTY', '').translate(_LIST_CHARS).replace(',', ' ').split())
+             if isinstance(t, str) else '' for t in texts]
+    return decode_polylines(texts)
+
+def decode_polyline(text):
+    return decode_polylines([text])[0]
+
+def decode_linestring(text):
+    return decode_linestrings([text])[0]
+
+def decode_int_list(text):
+    return decode_int_lists([text])[0]
+
+def decode_float_list(text):
+    return decode_lists([text], np.float64)[0]
+
+# Split a flat buffer back into one view per row (no copies)
+def split_lists(values, offsets):
+    return [values[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+# Inverse of decode_polyline, same format as str() of a list of [lon, lat] lists
+def encode_polyline(coords):
+    return str(np.asarray(coords, dtype=np.float64).tolist())
+
+# Remove consecutive duplicate points of every trip at once
+def drop_consecutive_duplicates(coords, offsets):
+    keep = np.ones(len(coords), dtype=bool)
+    if len(coords) > 1:
+        keep[1:] = np.any(coords[1:] != coords[:-1], axis=1)
+    keep[offsets[:-1][offsets[:-1] < len(coords)]] = True  # first point of each trip
+    kept = np.concatenate([[0], np.cumsum(keep)])
+    return coords[keep], kept[offsets]
+
+# Gather the given rows of a flat buffer into a new buffer and offsets
+def take_lists(values, offsets, rows):
+    rows = np.asarray(rows, dtype=np.int64)
+    starts = offsets[rows]
+    lengths = offsets[rows + 1] - starts
+    new_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=new_offsets[1:])
+    index = np.repeat(starts - new_offsets[:-1], lengths) + np.arange(new_offsets[-1])
+    return values[index], new_offsets
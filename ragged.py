@@ -0,0 +1,23 @@
+import numpy as np
+
+# Helpers for the ragged layout used throughout the project: row i of a flat buffer of values
+# is values[offsets[i]:offsets[i + 1]], with len(offsets) == number of rows + 1.
+
+# Positions of all ranges starts[i]:stops[i] concatenated, and the range each position belongs to
+def expand(starts, stops):
+    lengths = np.maximum(stops - starts, 0)
+    owner = np.repeat(np.arange(len(starts)), lengths)
+    offsets = np.zeros(len(starts) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    positions = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+    return positions, owner
+
+# Values and offsets of the rows start:stop
+def slice_rows(values, offsets, start, stop):
+    return values[offsets[start]:offsets[stop]], offsets[start:stop + 1] - offsets[start]
+
+# Offsets of values grouped by row, given the (sorted) row of every value
+def ragged_offsets(rows, num_rows):
+    offsets = np.zeros(num_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=num_rows), out=offsets[1:])
+    return offsets
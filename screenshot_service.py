@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import queue
+import hashlib
+import threading
+from selenium import webdriver
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.support.ui import WebDriverWait
+
+# Screenshots of folium HTML maps with a pool of headless Chrome workers. Each worker keeps
+# its browser for all pages it captures and waits for the map to be ready instead of
+# sleeping a fixed time. Captures whose HTML did not change since the last run are skipped.
+
+MANIFEST_FILE = './data/screenshot_manifest.json'
+
+# Ready once the document is loaded and every Leaflet tile has loaded or failed, then two
+# animation frames later so the canvas layers are drawn
+READY_SCRIPT = """
+var done = arguments[arguments.length - 1];
+if (document.readyState !== 'complete') { done(false); return; }
+var tiles = document.querySelectorAll('img.leaflet-tile');
+for (var i = 0; i < tiles.length; i++) {
+    if (!tiles[i].complete) { done(false); return; }
+}
+requestAnimationFrame(function () { requestAnimationFrame(function () { done(true); }); });
+"""
+
+def chrome_driver(window_size):
+    chrome_options = Options()
+    chrome_options.add_argument("--headless")
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    chrome_options.add_argument("--window-size={},{}".format(*window_size))
+    return webdriver.Chrome(options=chrome_options)
+
+def html_hash(html_file, window_size, script):
+    digest = hashlib.sha1()
+    with open(html_file, 'rb') as f:
+        digest.update(f.read())
+    digest.update(repr((tuple(window_size), script)).encode())
+    return digest.hexdigest()
+
+def load_manifest(manifest_file):
+    if not os.path.exists(manifest_file):
+        return {}
+    with open(manifest_file, 'r') as f:
+        return json.load(f)
+
+def save_manifest(manifest_file, manifest):
+    directory = os.path.dirname(manifest_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(manifest_file + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(manifest_file + '.tmp', manifest_file)
+
+# Open html_file and wait until its map is ready (READY_SCRIPT). script is run right after
+# opening the page. Returns the load time in seconds, None if not ready after timeout seconds.
+def load_page(driver, html_file, timeout, script=None):
+    start_time = time.perf_counter()
+    driver.get(f"file://{os.path.abspath(html_file)}")
+    if script is not None:
+        driver.execute_script(script)
+    try:
+        WebDriverWait(driver, timeout, poll_frequency=0.1).until(lambda d: d.execute_async_script(READY_SCRIPT))
+    except TimeoutException:
+        return None
+    return time.perf_counter() - start_time
+
+def capture_page(driver, html_file, image_file, timeout, script):
+    load_time = load_page(driver, html_file, timeout, script)
+    if load_time is None:
+        print(f"Map in {html_file} not ready after {timeout} s, capturing anyway")
+        load_time = timeout
+
+    directory = os.path.dirname(image_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    driver.save_screenshot(image_file)
+    print(f"Screenshot saved as {image_file} (loaded in {load_time:.2f} s)")
+
+# Capture the (html_file, image_file) jobs with num_workers browsers. script is run on every
+# page after loading it, e.g. to inject CSS. Returns the number of pages captured.
+def capture_pages(jobs, num_workers=4, window_size=(1500, 1000), timeout=30, script=None,
+                  manifest_file=MANIFEST_FILE, new_driver=chrome_driver):
+    manifest = load_manifest(manifest_file)
+    pending = queue.Queue()
+    for html_file, image_file in jobs:
+        digest = html_hash(html_file, window_size, script)
+        if os.path.exists(image_file) and manifest.get(image_file) == digest:
+            print(f"Screenshot {image_file} is up to date")
+            continue
+        pending.put((html_file, image_file, digest))
+
+    num_pages = pending.qsize()
+    lock = threading.Lock()
+    errors = []
+
+    def worker():
+        driver = None
+        try:
+            while True:
+                try:
+                    html_file, image_file, digest = pending.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    if driver is None:
+                        driver = new_driver(window_size)
+                    capture_page(driver, html_file, image_file, timeout, script)
+                except Exception as e:
+                    with lock:
+                        errors.append((html_file, e))
+                    continue
+                with lock:
+                    manifest[image_file] = digest
+        finally:
+            if driver is not None:
+                driver.quit()
+
+    workers = [threading.Thread(target=worker) for _ in range(min(num_workers, num_pages))]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    save_manifest(manifest_file, manifest)
+    for html_file, e in errors:
+        print(f"Error capturing {html_file}: {e}")
+    return num_pages - len(errors)
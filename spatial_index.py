@@ -0,0 +1,221 @@
+import numpy as np
+import shapely
+from shapely import STRtree
+from geo import EARTH_RADIUS
+from ragged import expand, ragged_offsets
+
+# Only needed to read the network file
+try:
+    import geopandas as gpd
+except ImportError:
+    gpd = None
+
+# Spatial indexes over the road network (an STRtree of edges) and over GPS points (a
+# sparse grid) for candidate lookup and bbox queries without fmm. Inputs are lon/lat, distances
+# are meters in an equirectangular projection around lat0, which is exact to well below a meter
+# within a city. Bulk queries return ragged results like the rest of the project: the matches of
+# query i are values[offsets[i]:offsets[i + 1]].
+
+def project(coords, lat0):
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    scale = np.radians(1.0) * EARTH_RADIUS
+    return np.column_stack([coords[:, 0] * scale * np.cos(np.radians(lat0)), coords[:, 1] * scale])
+
+# Distance from points p to segments a-b (all K x 2) and the position 0..1 of the closest point on the segment
+def segment_distances(p, a, b):
+    ab = b - a
+    squared = np.einsum('ij,ij->i', ab, ab)
+    t = np.einsum('ij,ij->i', p - a, ab) / np.where(squared > 0, squared, 1.0)
+    t = np.clip(t, 0.0, 1.0)
+    return np.hypot(*(p - a - t[:, None] * ab).T), t
+
+# Start index of every segment of the ragged polylines and the polyline it belongs to
+def polyline_segments(offsets):
+    owner = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    starts = np.flatnonzero(owner[:-1] == owner[1:])
+    return starts, owner[starts]
+
+def read_edge_file(path='porto/edges.shp'):
+    if gpd is None:
+        raise ImportError('geopandas is required to read the network file')
+    return gpd.read_parquet(path) if path.endswith('.parquet') else gpd.read_file(path)
+
+# Edges as ragged lon/lat polylines, edge eid = row of the file
+def edge_polylines(edges):
+    coords, owner = shapely.get_coordinates(edges.geometry.values, return_index=True)
+    return coords, ragged_offsets(owner, len(edges))
+
+def read_edge_polylines(path='porto/edges.shp'):
+    return edge_polylines(read_edge_file(path))
+
+class EdgeIndex:
+    def __init__(self, coords, offsets, lat0=None):
+        self.coords = np.asarray(coords, dtype=np.float64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.lat0 = float(np.mean(self.coords[:, 1])) if lat0 is None else lat0
+        num_edges = len(self.offsets) - 1
+
+        xy = project(self.coords, self.lat0)
+        self.segment_point, self.segment_edge = polyline_segments(self.offsets)
+        self.segment_length = np.hypot(*(xy[self.segment_point + 1] - xy[self.segment_point]).T)
+        # segments of edge e are segment_offsets[e]:segment_offsets[e + 1], in order along the edge
+        self.segment_offsets = ragged_offsets(self.segment_edge, num_edges)
+        self.cumulative_length = np.concatenate([[0.0], np.cumsum(self.segment_length)])
+        self.segment_start = self.cumulative_length[:-1] - self.cumulative_length[self.segment_offsets[self.segment_edge]]
+        self.edge_length = np.bincount(self.segment_edge, weights=self.segment_length, minlength=num_edges)
+        # distances and positions along the edges are computed by GEOS on the projected edges
+        self.geometries = shapely.linestrings(xy, indices=np.repeat(np.arange(num_edges), np.diff(self.offsets)))
+        self.tree = STRtree(self.geometries)
+
+    @classmethod
+    def from_file(cls, path='porto/edges.shp', lat0=None):
+        return cls(*read_edge_polylines(path), lat0=lat0)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    # All edges within radius meters of each point: (offsets, eids, distances, positions) with
+    # one candidate per point and edge, closest first. positions are meters along the edge.
+    def within(self, points, radius):
+        points = shapely.points(project(points, self.lat0))
+        rows, eids = self.tree.query(points, predicate='dwithin', distance=radius)
+        distances = shapely.distance(self.geometries[eids], points[rows])
+        positions = shapely.line_locate_point(self.geometries[eids], points[rows])
+        order = np.lexsort((distances, rows))
+        return ragged_offsets(rows, len(points)), eids[order], distances[order], positions[order]
+
+    # The k closest edges within radius meters of each point, like the candidates of fmm
+    def nearest(self, points, k=8, radius=200.0):
+        offsets, eids, distances, positions = self.within(points, radius)
+        counts = np.minimum(np.diff(offsets), k)
+        keep, _ = expand(offsets[:-1], offsets[:-1] + counts)
+        new_offsets = np.zeros(len(offsets), dtype=np.int64)
+        np.cumsum(counts, out=new_offsets[1:])
+        return new_offsets, eids[keep], distances[keep], positions[keep]
+
+    # Edges intersecting each (min_lon, min_lat, max_lon, max_lat) bbox: (offsets, eids)
+    def in_bboxes(self, bboxes):
+        bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+        low, high = project(bboxes[:, :2], self.lat0), project(bboxes[:, 2:], self.lat0)
+        rows, eids = self.tree.query(shapely.box(low[:, 0], low[:, 1], high[:, 0], high[:, 1]), predicate='intersects')
+        order = np.lexsort((eids, rows))
+        return ragged_offsets(rows, len(bboxes)), eids[order]
+
+    def in_bbox(self, bbox):
+        return self.in_bboxes([bbox])[1]
+
+    # lon/lat of the points at positions (meters along the edge) of the edges eids
+    def locate(self, eids, positions):
+        eids = np.asarray(eids, dtype=np.int64)
+        positions = np.asarray(positions, dtype=np.float64)
+        along = self.cumulative_length[self.segment_offsets[eids]] + positions
+        segments = np.searchsorted(self.cumulative_length[1:], along, side='right')
+        segments = np.clip(segments, self.segment_offsets[eids], self.segment_offsets[eids + 1] - 1)
+        lengths = self.segment_length[segments]
+        t = np.clip((positions - self.segment_start[segments]) / np.where(lengths > 0, lengths, 1.0), 0.0, 1.0)
+        a, b = self.coords[self.segment_point[segments]], self.coords[self.segment_point[segments] + 1]
+        return a + t[:, None] * (b - a)
+
+    # lon/lat polyline of edge eid between the positions start and stop (meters along the edge)
+    def edge_slice(self, eid, start=0.0, stop=None):
+        stop = self.edge_length[eid] if stop is None else stop
+        first, last = self.segment_offsets[eid], self.segment_offsets[eid + 1]
+        vertex_positions = self.segment_start[first + 1:last]
+        inner = self.coords[self.segment_point[first + 1:last][(vertex_positions > start) & (vertex_positions < stop)]]
+        ends = self.locate([eid, eid], [start, stop])
+        return np.concatenate([ends[:1], inner, ends[1:]])
+
+    # Segment end points of the given edges in lon/lat, e.g. to query a PointGrid along them
+    def edge_segments(self, eids):
+        eids = np.asarray(eids, dtype=np.int64)
+        segments, _ = expand(self.segment_offsets[eids], self.segment_offsets[eids + 1])
+        points = self.segment_point[segments]
+        return self.coords[points], self.coords[points + 1]
+
+# Sparse grid over the GPS points of ragged trips. Only occupied cells are stored, so points
+# far outside the city (GPS errors) do not blow up the grid.
+class PointGrid:
+    def __init__(self, coords, offsets, cell_size=100.0, lat0=None):
+        self.coords = np.asarray(coords, dtype=np.float64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        if lat0 is None:
+            lat0 = float(np.mean(self.coords[:, 1])) if len(self.coords) else 0.0
+        self.lat0 = lat0
+        self.cell_size = cell_size
+        self.xy = project(self.coords, self.lat0)
+        self.trip_of_point = np.repeat(np.arange(len(self.offsets) - 1), np.diff(self.offsets))
+
+        self.origin = self.xy.min(axis=0) if len(self.xy) else np.zeros(2)
+        cells = self._cells(self.xy)
+        self.width, self.height = (cells.max(axis=0) + 1).tolist() if len(cells) else (1, 1)
+        keys = cells[:, 1] * self.width + cells[:, 0]
+        self.order = np.argsort(keys, kind='stable')
+        self.cell_keys, starts = np.unique(keys[self.order], return_index=True)
+        self.cell_offsets = np.append(starts, len(keys)).astype(np.int64)
+        self.cell_xy = self.xy[self.order]  # points in cell order, candidates are contiguous runs
+
+    def _cells(self, xy):
+        return np.floor((xy - self.origin) / self.cell_size).astype(np.int64)
+
+    # Points in the cells overlapping the rectangles low-high (meters): (rectangle of each candidate,
+    # position of the point in cell order). Cell keys are row-major, so the occupied cells of one
+    # grid row of a rectangle are a run of cell_keys and their points a run of the cell order:
+    # two lookups per grid row of a rectangle instead of one per cell.
+    def _candidates(self, low, high):
+        low = np.maximum(self._cells(low), 0)
+        high = np.minimum(self._cells(high), [self.width - 1, self.height - 1])
+        heights = np.where(high[:, 0] >= low[:, 0], np.maximum(high[:, 1] - low[:, 1] + 1, 0), 0)
+        row_index, rect = expand(np.zeros(len(low), dtype=np.int64), heights)
+        y = low[rect, 1] + row_index
+        first = np.searchsorted(self.cell_keys, y * self.width + low[rect, 0])
+        last = np.searchsorted(self.cell_keys, y * self.width + high[rect, 0], side='right')
+        positions, owner = expand(self.cell_offsets[first], self.cell_offsets[last])
+        return rect[owner], positions
+
+    # Points within radius meters of each query point: (offsets, point indices, distances)
+    def within(self, points, radius):
+        xy = project(points, self.lat0)
+        rows, positions = self._candidates(xy - radius, xy + radius)
+        distances = np.hypot(*(self.cell_xy[positions] - xy[rows]).T)
+        close = distances <= radius
+        rows, candidates, distances = rows[close], self.order[positions[close]], distances[close]
+        order = np.lexsort((distances, rows))
+        return ragged_offsets(rows, len(xy)), candidates[order], distances[order]
+
+    # Points inside each (min_lon, min_lat, max_lon, max_lat) bbox: (offsets, point indices)
+    def in_bboxes(self, bboxes):
+        bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+        low, high = project(bboxes[:, :2], self.lat0), project(bboxes[:, 2:], self.lat0)
+        rows, positions = self._candidates(low, high)
+        xy = self.cell_xy[positions]
+        inside = (xy[:, 0] >= low[rows, 0]) & (xy[:, 0] <= high[rows, 0]) & \
+            (xy[:, 1] >= low[rows, 1]) & (xy[:, 1] <= high[rows, 1])
+        # one sort of (bbox, point) keys orders the points of every bbox
+        num_points = max(len(self.xy), 1)
+        keys = np.sort(rows[inside] * num_points + self.order[positions[inside]])
+        return ragged_offsets(keys // num_points, len(bboxes)), keys % num_points
+
+    def in_bbox(self, bbox):
+        return self.in_bboxes([bbox])[1]
+
+    def trips_in_bbox(self, bbox):
+        return np.unique(self.trip_of_point[self.in_bbox(bbox)])
+
+    # Trips with a GPS point within radius meters of the segments a-b (lon/lat, e.g. from
+    # EdgeIndex.edge_segments), e.g. the trips that touch a way
+    def trips_near_segments(self, a, b, radius):
+        a, b = project(a, self.lat0), project(b, self.lat0)
+        rows, positions = self._candidates(np.minimum(a, b) - radius, np.maximum(a, b) + radius)
+        distances, _ = segment_distances(self.cell_xy[positions], a[rows], b[rows])
+        return np.unique(self.trip_of_point[self.order[positions[distances <= radius]]])
+
+    # lon/lat bbox (min_lon, min_lat, max_lon, max_lat) of every trip, without a Python loop
+    def trip_bounds(self):
+        num_trips = len(self.offsets) - 1
+        bounds = np.full((num_trips, 4), np.nan)
+        nonempty = np.flatnonzero(np.diff(self.offsets) > 0)
+        if len(nonempty):
+            starts = self.offsets[nonempty]
+            bounds[nonempty, :2] = np.minimum.reduceat(self.coords, starts)
+            bounds[nonempty, 2:] = np.maximum.reduceat(self.coords, starts)
+        return bounds
@@ -0,0 +1,87 @@
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw
+from basemap import get_stitched_tiles
+
+# Static PNG maps drawn straight onto the stitched OSM tiles of basemap.py, without a browser.
+# Coordinates are projected to Web Mercator pixels at the zoom level of the tiles, so trips,
+# matched routes and bounding boxes line up with the basemap exactly.
+
+TILE_SIZE = 256
+MARGIN = 0.005  # degrees around the trips, as in the folium maps
+MAX_ZOOM = 18
+COLORS = {'lightred': '#ff8e7f'}  # folium marker colors that are not CSS colors
+
+def lonlat_to_pixels(coords, zoom):
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    scale = TILE_SIZE * 2 ** zoom
+    x = (coords[:, 0] + 180.0) / 360.0 * scale
+    y = (1.0 - np.arcsinh(np.tan(np.radians(coords[:, 1]))) / np.pi) / 2.0 * scale
+    return np.column_stack([x, y])
+
+def pixels_to_lonlat(pixels, zoom):
+    pixels = np.asarray(pixels, dtype=np.float64).reshape(-1, 2)
+    scale = TILE_SIZE * 2 ** zoom
+    lon = pixels[:, 0] / scale * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * pixels[:, 1] / scale))))
+    return np.column_stack([lon, lat])
+
+def bbox_corners(bbox):
+    min_lon, min_lat, max_lon, max_lat = bbox
+    return np.array([[min_lon, min_lat], [max_lon, max_lat]])
+
+# View (zoom, pixel origin of the top-left corner) of the highest zoom at which all coords
+# plus the margin fit into an image of the given size, centered on them
+def plan_view(*coords, size=(1500, 1000), margin=MARGIN, max_zoom=MAX_ZOOM):
+    points = np.concatenate([np.asarray(c, dtype=np.float64).reshape(-1, 2) for c in coords])
+    corners = np.array([points.min(axis=0) - margin, points.max(axis=0) + margin])
+    for zoom in range(max_zoom, -1, -1):
+        pixels = lonlat_to_pixels(corners, zoom)
+        extent = np.abs(pixels[1] - pixels[0])
+        if extent[0] <= size[0] and extent[1] <= size[1]:
+            break
+    origin = np.floor(pixels.mean(axis=0) - np.array(size) / 2)
+    return zoom, origin
+
+# lon/lat bbox of a view, e.g. to prefetch the tiles of many views with basemap.prefetch_tiles
+def view_bbox(view, size=(1500, 1000)):
+    zoom, origin = view
+    # pixel centers of the first and last pixel, so no tile outside of the view is included
+    (lon1, lat1), (lon2, lat2) = pixels_to_lonlat([origin + 0.5, origin + np.array(size) - 0.5], zoom)
+    return min(lon1, lon2), min(lat1, lat2), max(lon1, lon2), max(lat1, lat2)
+
+def basemap_image(view, size=(1500, 1000)):
+    zoom, origin = view
+    stitched, extent = get_stitched_tiles(view_bbox(view, size), zoom)
+    min_lon, max_lon, min_lat, max_lat = extent
+    tiles_origin = np.round(lonlat_to_pixels([[min_lon, max_lat]], zoom)[0])
+    x, y = (origin - tiles_origin).astype(int)
+    return Image.fromarray(np.ascontiguousarray(stitched[y:y + size[1], x:x + size[0]]))
+
+def color_of(color):
+    return ImageColor.getrgb(COLORS.get(color, color))[:3]
+
+# Render trips (M x 2 lon/lat arrays, one color each) with their GPS points and routes and
+# optional bounding boxes (min_lon, min_lat, max_lon, max_lat) to a PNG file. The view fits
+# everything drawn unless a view from plan_view is given.
+def render_trips(image_file, trip_coords, colors, bboxes=(), bbox_color='red', size=(1500, 1000),
+                 view=None, radius=3, weight=2, show_points=True):
+    if view is None:
+        view = plan_view(*trip_coords, *[bbox_corners(bbox) for bbox in bboxes], size=size)
+    zoom, origin = view
+    image = basemap_image(view, size)
+    draw = ImageDraw.Draw(image)
+
+    for coords, color in zip(trip_coords, colors):
+        rgb = color_of(color)
+        pixels = lonlat_to_pixels(coords, zoom) - origin
+        if len(pixels) > 1:
+            draw.line([tuple(p) for p in pixels.tolist()], fill=rgb, width=weight, joint='curve')
+        if show_points:
+            for x, y in pixels.tolist():
+                draw.ellipse([x - radius, y - radius, x + radius, y + radius], fill=rgb)
+
+    for bbox in bboxes:
+        (x1, y1), (x2, y2) = (lonlat_to_pixels(bbox_corners(bbox), zoom) - origin).tolist()
+        draw.rectangle([min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)], outline=color_of(bbox_color), width=1)
+
+    image.save(image_file)
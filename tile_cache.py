@@ -0,0 +1,85 @@
+import os
+import time
+import sqlite3
+import threading
+
+# Persistent map tile store in a single SQLite file, keyed by (z, x, y). Tiles are kept
+# as the compressed PNG bytes the tile server returned; the least recently used tiles
+# are evicted once the total size exceeds max_bytes. Reads only note the time a tile was
+# used, the last_used column is updated in one transaction with the next put, once
+# touch_batch reads are pending, or on close.
+class TileCache:
+    def __init__(self, path, max_bytes=512 * 1024 * 1024, touch_batch=256):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.touch_batch = touch_batch
+        self.touched = {}
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS tiles ('
+                        'z INTEGER, x INTEGER, y INTEGER, data BLOB, size INTEGER, last_used REAL, '
+                        'PRIMARY KEY (z, x, y))')
+        self.db.execute('CREATE INDEX IF NOT EXISTS tiles_last_used ON tiles (last_used)')
+        self.db.commit()
+        self.total_bytes = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM tiles').fetchone()[0]
+
+    def __contains__(self, key):
+        z, x, y = key
+        with self.lock:
+            row = self.db.execute('SELECT 1 FROM tiles WHERE z=? AND x=? AND y=?', (z, x, y)).fetchone()
+        return row is not None
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM tiles').fetchone()[0]
+
+    # PNG bytes of a tile or None if it is not cached
+    def get(self, z, x, y):
+        with self.lock:
+            row = self.db.execute('SELECT data FROM tiles WHERE z=? AND x=? AND y=?', (z, x, y)).fetchone()
+            if row is None:
+                return None
+            self.touched[(z, x, y)] = time.time()
+            if len(self.touched) >= self.touch_batch:
+                self._flush_touched()
+                self.db.commit()
+        return bytes(row[0])
+
+    def put(self, z, x, y, data):
+        with self.lock:
+            row = self.db.execute('SELECT size FROM tiles WHERE z=? AND x=? AND y=?', (z, x, y)).fetchone()
+            if row is not None:
+                self.total_bytes -= row[0]
+            self.touched.pop((z, x, y), None)
+            self._flush_touched()
+            self.db.execute('INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?, ?)',
+                            (z, x, y, sqlite3.Binary(data), len(data), time.time()))
+            self.total_bytes += len(data)
+            self._evict()
+            self.db.commit()
+
+    def _flush_touched(self):
+        if self.touched:
+            self.db.executemany('UPDATE tiles SET last_used=? WHERE z=? AND x=? AND y=?',
+                                [(used, z, x, y) for (z, x, y), used in self.touched.items()])
+            self.touched = {}
+
+    def _evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        evicted = []
+        for z, x, y, size in self.db.execute('SELECT z, x, y, size FROM tiles ORDER BY last_used'):
+            if self.total_bytes <= self.max_bytes:
+                break
+            evicted.append((z, x, y))
+            self.total_bytes -= size
+        self.db.executemany('DELETE FROM tiles WHERE z=? AND x=? AND y=?', evicted)
+
+    def close(self):
+        with self.lock:
+            self._flush_touched()
+            self.db.commit()
+            self.db.close()
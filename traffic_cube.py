@@ -0,0 +1,152 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from traversal import trip_way_times
+from aggregate_store import FIELDS, WayAggregates
+
+# Way x time-bucket cube of the route analysis metrics: the fields of WayAggregates (trips,
+# timed trips, total time, sum of squares of the per-trip times) per way, hour of day, DAY_TYPE
+# and CALL_TYPE of the trips, as dense arrays of shape (ways, 24, 3, 3) in one directory:
+#   way_ids.npy (sorted), trips.npy, timed_trips.npy, time.npy, time_sq.npy and meta.json.
+# A trip counts towards the local hour its TIMESTAMP (start) falls into. Slices are summed over
+# the selected buckets into WayAggregates, so top-K works as on the global aggregates.
+HOURS = 24
+DAY_TYPES = ['A', 'B', 'C']
+CALL_TYPES = ['A', 'B', 'C']
+TIME_ZONE = 'Europe/Lisbon'
+SHAPE = (HOURS, len(DAY_TYPES), len(CALL_TYPES))
+
+# Local hour of unix timestamps
+def local_hours(timestamps):
+    times = pd.to_datetime(pd.Series(np.asarray(timestamps, dtype=np.int64)), unit='s', utc=True)
+    return times.dt.tz_convert(TIME_ZONE).dt.hour.to_numpy(dtype=np.int64)
+
+# Index of every value in categories, raises ValueError for values outside of them
+def category_index(values, categories, name):
+    values = np.asarray(values, dtype=str)
+    index = np.searchsorted(categories, values)
+    found = index < len(categories)
+    found[found] = np.asarray(categories)[index[found]] == values[found]
+    if not found.all():
+        raise ValueError(f'Unknown {name} values: {sorted(set(values[~found].tolist()))}')
+    return index
+
+# Bucket (hour, day type, call type) of every trip of the frame (TIMESTAMP, DAY_TYPE, CALL_TYPE)
+def trip_buckets(trips):
+    return np.ravel_multi_index((local_hours(trips['TIMESTAMP']),
+                                 category_index(trips['DAY_TYPE'], DAY_TYPES, 'DAY_TYPE'),
+                                 category_index(trips['CALL_TYPE'], CALL_TYPES, 'CALL_TYPE')), SHAPE)
+
+# Builds the cube of all trips of the MatchedStore store in one pass, trips is the frame of
+# TRIP_ID, TIMESTAMP, DAY_TYPE and CALL_TYPE (e.g. from trip_store.read_trips). Matched trips
+# missing from trips are skipped. meta is stored along, e.g. to tell whether the cube is stale.
+# Returns the number of trips in the cube.
+def build_traffic_cube(store, trips, way_ids, way_offsets, length_of, directory='data/traffic_cube', meta=None):
+    trip_ids = trips['TRIP_ID'].to_numpy(dtype=np.int64)
+    order = np.argsort(trip_ids, kind='stable')
+    rows = np.searchsorted(trip_ids[order], store.trip_ids)
+    found = rows < len(trip_ids)
+    found[found] = trip_ids[order][rows[found]] == store.trip_ids[found]
+    bucket_of_match = np.full(len(store), -1, dtype=np.int64)
+    bucket_of_match[found] = trip_buckets(trips.iloc[order[rows[found]]])
+
+    entry_trips, wids, times, timed = trip_way_times(*store.ragged('cpath'), *store.ragged('indices'),
+                                                     way_ids, way_offsets, length_of)
+    buckets = bucket_of_match[entry_trips]
+    known = buckets >= 0
+    wids, times, timed, buckets = wids[known], times[known], timed[known], buckets[known]
+
+    cube_way_ids, way_index = np.unique(wids, return_inverse=True)
+    cells = way_index.reshape(-1) * int(np.prod(SHAPE)) + buckets
+    size = len(cube_way_ids) * int(np.prod(SHAPE))
+    shape = (len(cube_way_ids),) + SHAPE
+    fields = {
+        'way_ids': cube_way_ids,
+        'trips': np.bincount(cells, minlength=size).astype(np.int32).reshape(shape),
+        'timed_trips': np.bincount(cells[timed], minlength=size).astype(np.int32).reshape(shape),
+        'time': np.bincount(cells, weights=times, minlength=size).reshape(shape),
+        'time_sq': np.bincount(cells, weights=np.square(times), minlength=size).reshape(shape),
+    }
+
+    os.makedirs(directory, exist_ok=True)
+    for field in FIELDS:
+        np.save(os.path.join(directory, field + '.npy'), fields[field])
+    # written last, a cube without it is incomplete
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump(dict(meta or {}, trips=int(found.sum())), f)
+    return int(found.sum())
+
+def read_cube_meta(directory='data/traffic_cube'):
+    path = os.path.join(directory, 'meta.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+class TrafficCube:
+    def __init__(self, directory='data/traffic_cube'):
+        self.meta = read_cube_meta(directory)
+        for field in FIELDS:
+            setattr(self, field, np.load(os.path.join(directory, field + '.npy'), mmap_mode='r'))
+
+    def __len__(self):
+        return len(self.way_ids)
+
+    # Rows of the given way ids, -1 for ways that no trip of the cube uses
+    def rows_of(self, wids):
+        wids = np.asarray(wids, dtype=np.int64)
+        rows = np.searchsorted(self.way_ids, wids)
+        found = rows < len(self.way_ids)
+        found[found] = self.way_ids[rows[found]] == wids[found]
+        return np.where(found, rows, -1)
+
+    # Aggregates of the selected hours, day types and call types (None selects all of them),
+    # summed as one product of every field with the 0/1 mask of the selected buckets
+    def slice(self, hours=None, day_types=None, call_types=None):
+        mask = bucket_mask(hours, day_types, call_types).ravel()
+        return WayAggregates(self.way_ids, *[_flat(getattr(self, field)) @ mask.astype(getattr(self, field).dtype)
+                                             for field in FIELDS[1:]])
+
+    # The k ways of a slice used by the most trips and their trip counts
+    def top_trips(self, k, hours=None, day_types=None, call_types=None):
+        aggregates = self.slice(hours, day_types, call_types)
+        rows = aggregates.top_trips(k)
+        return aggregates.way_ids[rows], aggregates.trips[rows]
+
+    # The k timed ways of a slice with the highest mean time per trip and those means
+    def top_mean_time(self, k, hours=None, day_types=None, call_types=None):
+        aggregates = self.slice(hours, day_types, call_types)
+        rows = aggregates.top_mean_time(k)
+        return aggregates.way_ids[rows], aggregates.mean_time()[rows]
+
+    # Trips and mean time per trip by hour of day (len(wids) x 24) of the given ways
+    def hourly(self, wids, day_types=None, call_types=None):
+        rows = self.rows_of(wids)
+        if (rows < 0).any():
+            raise KeyError(f'Ways not in the cube: {np.asarray(wids)[rows < 0].tolist()}')
+        mask = bucket_mask(None, day_types, call_types)[0].ravel()
+        trips = self.trips[rows].reshape(len(rows), HOURS, -1) @ mask.astype(self.trips.dtype)
+        time = self.time[rows].reshape(len(rows), HOURS, -1) @ mask.astype(self.time.dtype)
+        return trips, time / np.maximum(trips, 1)
+
+# Selected buckets (None selects all hours, day types or call types) as a 24 x 3 x 3 mask
+def bucket_mask(hours=None, day_types=None, call_types=None):
+    mask = np.zeros(SHAPE, dtype=bool)
+    if hours is not None:
+        hours = np.atleast_1d(np.asarray(hours, dtype=np.int64))
+        if ((hours < 0) | (hours >= HOURS)).any():
+            raise ValueError(f'Hours out of range 0..{HOURS - 1}: {hours.tolist()}')
+    mask[np.ix_(*[np.arange(size) if values is None else values for size, values in zip(SHAPE, [
+        hours,
+        _categories(day_types, DAY_TYPES, 'DAY_TYPE'),
+        _categories(call_types, CALL_TYPES, 'CALL_TYPE')])])] = True
+    return mask
+
+# A (ways, 24, 3, 3) field as ways x buckets
+def _flat(field):
+    return field.reshape(len(field), -1)
+
+# Indices of the selected categories, None selects all of them
+def _categories(values, categories, name):
+    return None if values is None else category_index(np.atleast_1d(values), categories, name)
@@ -0,0 +1,57 @@
+import math
+import numpy as np
+from geo import EARTH_RADIUS, haversine
+
+# The point-by-point kernels are compiled with numba when it is installed and run as plain Python otherwise
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda function: function
+
+# Distance in meters of every pair of consecutive points within a trip, for all trips at once
+def segment_lengths(coords, offsets):
+    if len(coords) < 2:
+        return np.zeros(0, dtype=np.float64)
+    distances = haversine(coords[:-1, 0], coords[:-1, 1], coords[1:, 0], coords[1:, 1])
+    within = np.ones(len(distances), dtype=bool)
+    starts = offsets[1:-1]
+    within[starts[(starts > 0) & (starts < len(coords))] - 1] = False  # pairs across two trips
+    return distances[within]
+
+@njit(cache=True)
+def _haversine(lon1, lat1, lon2, lat2):
+    lon1, lat1, lon2, lat2 = math.radians(lon1), math.radians(lat1), math.radians(lon2), math.radians(lat2)
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+@njit(cache=True)
+def _outlier_kernel(coords, offsets, min_thresh, max_thresh, step_thresh, noise_thresh, keep):
+    for trip in range(len(offsets) - 1):
+        start, stop = offsets[trip], offsets[trip + 1]
+        if stop - start < 2:
+            keep[start:stop] = True
+            continue
+        keep[start] = True
+        last, threshold = start, min_thresh
+        for i in range(start + 1, stop):
+            distance = _haversine(coords[last, 0], coords[last, 1], coords[i, 0], coords[i, 1])
+            if distance < threshold and distance > noise_thresh:
+                keep[i] = True
+                last, threshold = i, min_thresh
+            else:
+                threshold = min(threshold + step_thresh, max_thresh)
+
+# Adaptive-threshold outlier filter over all trips (thresholds in meters). A point is kept if it
+# is farther than noise_thresh and closer than the threshold from the last kept point; every
+# rejected point widens the threshold by step_thresh up to max_thresh, so the trip can recover
+# after a gap. Returns the kept coords and their offsets.
+def filter_outliers(coords, offsets, min_thresh=500.0, max_thresh=10000.0, step_thresh=500.0, noise_thresh=20.0):
+    coords = np.ascontiguousarray(coords, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    keep = np.zeros(len(coords), dtype=np.bool_)
+    _outlier_kernel(coords, offsets, float(min_thresh), float(max_thresh), float(step_thresh), float(noise_thresh), keep)
+    kept = np.concatenate([[0], np.cumsum(keep)])
+    return coords[keep], kept[offsets]
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+from polylines import decode_int_lists
+from ragged import expand
+
+# Seconds between two GPS samples of the Porto dataset
+SAMPLE_INTERVAL = 15
+
+# Edge -> OSM way lookup as CSR: the way ids of edge eid are way_ids[way_offsets[eid]:way_offsets[eid + 1]]
+def edge_way_table(path='data/edges_eid_to_osmid.csv'):
+    osm_edges = pd.read_csv(path, usecols=['osmid'])
+    return decode_int_lists(osm_edges.osmid.astype(str))
+
+def edges_to_way_ids(eids, way_ids, way_offsets):
+    eids = np.asarray(eids, dtype=np.int64)
+    positions, _ = expand(way_offsets[eids], way_offsets[eids + 1])
+    return way_ids[positions]
+
+# One entry per (trip, matched point pair, way) of all trips: for the pair of matched
+# points i, i + 1 of a trip these are the ways of the edges cpath[indices[i]:indices[i + 1] + 1]
+def pair_ways(cpath, cpath_offsets, indices, indices_offsets, way_ids, way_offsets):
+    num_trips = len(indices_offsets) - 1
+    trip_of_index = np.repeat(np.arange(num_trips), np.diff(indices_offsets))
+    first = np.flatnonzero(trip_of_index[:-1] == trip_of_index[1:])  # pairs never span two trips
+    pair_trip = trip_of_index[first]
+
+    starts = cpath_offsets[pair_trip] + indices[first]
+    stops = np.minimum(cpath_offsets[pair_trip] + indices[first + 1] + 1, cpath_offsets[pair_trip + 1])
+    edge_positions, edge_pair = expand(starts, stops)
+    eids = cpath[edge_positions]
+
+    way_positions, way_edge = expand(way_offsets[eids], way_offsets[eids + 1])
+    way_pair = edge_pair[way_edge]
+    return pair_trip, way_pair, way_ids[way_positions]
+
+# Time spent by every trip on every way it uses, one entry per (trip, way) of all trips: the 15 s
+# between two matched points are shared among the ways of their edges in proportion to way
+# length, given by length_of(wids) (e.g. WayAttributes.length_of).
+# Returns (trips, wids, times, timed), timed marks entries that received a share of time at
+# all (pairs whose ways have zero total length are skipped).
+def trip_way_times(cpath, cpath_offsets, indices, indices_offsets, way_ids, way_offsets, length_of):
+    pair_trip, way_pair, pair_wids = pair_ways(cpath, cpath_offsets, indices, indices_offsets, way_ids, way_offsets)
+    wids, way_index = np.unique(pair_wids, return_inverse=True)
+    way_index = way_index.reshape(-1)
+    trip_way, entry = np.unique(pair_trip[way_pair] * len(wids) + way_index, return_inverse=True)
+    entry = entry.reshape(-1)
+
+    lengths = np.asarray(length_of(wids), dtype=np.float64)[way_index]
+    total_len = np.bincount(way_pair, weights=lengths, minlength=len(pair_trip))[way_pair]
+    valid = total_len > 0
+    shares = SAMPLE_INTERVAL * lengths[valid] / total_len[valid]
+    times = np.bincount(entry[valid], weights=shares, minlength=len(trip_way))
+    timed = np.bincount(entry[valid], minlength=len(trip_way)) > 0
+    num_wids = max(len(wids), 1)
+    return trip_way // num_wids, wids[trip_way % num_wids], times, timed
+
+# Traversal frequency and time spent of every way in one pass over all trips.
+# number_of_trips counts every trip once per way it uses, time_spent sums trip_way_times.
+# Returns (wids, number_of_trips, time_spent, timed), timed marks ways that received
+# a share of time at all.
+def aggregate_traversals(cpath, cpath_offsets, indices, indices_offsets, way_ids, way_offsets, length_of):
+    _, trip_wids, times, timed_entries = trip_way_times(cpath, cpath_offsets, indices, indices_offsets,
+                                                         way_ids, way_offsets, length_of)
+    wids, way_index = np.unique(trip_wids, return_inverse=True)
+    way_index = way_index.reshape(-1)
+    number_of_trips = np.bincount(way_index, minlength=len(wids))
+    time_spent = np.bincount(way_index, weights=times, minlength=len(wids))
+    timed = np.bincount(way_index[timed_entries], minlength=len(wids)) > 0
+    return wids, number_of_trips, time_spent, timed
@@ -0,0 +1,132 @@
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from polylines import decode_polylines, drop_consecutive_duplicates
+
+# Columnar store for trips: one row per trip with the POLYLINE kept as a nested
+# list<[lon, lat]> column, so readers get coords/offsets without parsing any text
+SCHEMA = pa.schema([
+    ('TRIP_ID', pa.int64()),
+    ('CALL_TYPE', pa.string()),
+    ('ORIGIN_CALL', pa.int64()),
+    ('ORIGIN_STAND', pa.int64()),
+    ('TAXI_ID', pa.int64()),
+    ('TIMESTAMP', pa.int64()),
+    ('DAY_TYPE', pa.string()),
+    ('MISSING_DATA', pa.bool_()),
+    ('POLYLINE', pa.list_(pa.list_(pa.float64(), 2))),
+])
+ROW_GROUP_SIZE = 10000
+TRIP_COLUMNS = [field.name for field in SCHEMA if field.name != 'POLYLINE']
+
+def _trip_columns(trips):
+    frame = pd.DataFrame(trips)
+    columns = {}
+    for field in SCHEMA:
+        if field.name == 'POLYLINE':
+            continue
+        values = frame[field.name]
+        if pa.types.is_integer(field.type):
+            values = pd.to_numeric(values.replace('', None), errors='coerce').astype('Int64')
+        elif pa.types.is_boolean(field.type):
+            values = values.astype(str) == 'True'
+        else:
+            values = values.astype(str)
+        columns[field.name] = pa.array(values, type=field.type, from_pandas=True)
+    return columns
+
+def _trip_table(trips, coords, offsets):
+    columns = _trip_columns(trips)
+    points = pa.FixedSizeListArray.from_arrays(pa.array(np.ascontiguousarray(coords, dtype=np.float64).ravel()), 2)
+    columns['POLYLINE'] = pa.ListArray.from_arrays(pa.array(offsets, type=pa.int32()), points)
+    return pa.table(columns, schema=SCHEMA)
+
+# Write trips (DataFrame or list of row dicts) with their coords (M x 2) and offsets (n + 1)
+def write_trips(path, trips, coords, offsets, row_group_size=ROW_GROUP_SIZE):
+    pq.write_table(_trip_table(trips, coords, offsets), path, row_group_size=row_group_size)
+
+def polyline_arrays(table):
+    column = table.column('POLYLINE').combine_chunks()
+    offsets = column.offsets.to_numpy().astype(np.int64)
+    coords = column.flatten().flatten().to_numpy().reshape(-1, 2)
+    return coords, offsets - offsets[0]
+
+# Read trips with column projection and TRIP_ID / TIMESTAMP predicate pushdown.
+# Returns the attribute frame plus coords and offsets (None if POLYLINE is not read).
+def read_trips(path, columns=None, trip_ids=None, start_time=None, end_time=None, limit=None):
+    dataset = ds.dataset(path, format='parquet')
+    condition = None
+    if trip_ids is not None:
+        condition = ds.field('TRIP_ID').isin([int(trip_id) for trip_id in trip_ids])
+    if start_time is not None:
+        expression = ds.field('TIMESTAMP') >= int(start_time)
+        condition = expression if condition is None else condition & expression
+    if end_time is not None:
+        expression = ds.field('TIMESTAMP') < int(end_time)
+        condition = expression if condition is None else condition & expression
+
+    if limit is not None:
+        table = dataset.head(limit, columns=columns, filter=condition)
+    else:
+        table = dataset.to_table(columns=columns, filter=condition)
+
+    coords, offsets = None, None
+    if 'POLYLINE' in table.column_names:
+        coords, offsets = polyline_arrays(table)
+        table = table.drop_columns(['POLYLINE'])
+    return table.to_pandas(), coords, offsets
+
+# Stream the trips of a store in batches of at most batch_size trips as (attribute frame,
+# coords, offsets). Integer columns are nullable Int64, so they are written back unchanged.
+def iter_trips(path, columns=None, batch_size=ROW_GROUP_SIZE):
+    dataset = ds.dataset(path, format='parquet')
+    for batch in dataset.to_batches(columns=columns, batch_size=batch_size):
+        table = pa.Table.from_batches([batch])
+        coords, offsets = None, None
+        if 'POLYLINE' in table.column_names:
+            coords, offsets = polyline_arrays(table)
+            table = table.drop_columns(['POLYLINE'])
+        yield table.to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get), coords, offsets
+
+# Incremental counterpart of write_trips for streaming stages: every write() appends a chunk
+# of trips to the parquet file at path, close() finalizes it. The file is built under a
+# temporary name, so if the stage fails (abort(), or an exception inside a with block) the
+# output of an earlier run stays as it was instead of being replaced by a partial one.
+class TripStoreWriter:
+    def __init__(self, path, row_group_size=ROW_GROUP_SIZE):
+        self.row_group_size = row_group_size
+        self.path = path
+        self.parquet = pq.ParquetWriter(path + '.tmp', SCHEMA)
+
+    def write(self, trips, coords, offsets):
+        self.parquet.write_table(_trip_table(trips, coords, offsets), row_group_size=self.row_group_size)
+
+    def close(self):
+        self.parquet.close()
+        os.replace(self.path + '.tmp', self.path)
+
+    # Drops what was written so far
+    def abort(self):
+        self.parquet.close()
+        os.remove(self.path + '.tmp')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+# Stream a train.csv-like file into the trip store at path without holding it in memory.
+# Consecutive duplicate points are dropped like in 01_take-1500.py, so every trip store
+# holds the same deduplicated points.
+def build_trip_store(csv_path, path, chunk_size=100000):
+    with TripStoreWriter(path) as writer:
+        for chunk in pd.read_csv(csv_path, chunksize=chunk_size, dtype=str, keep_default_na=False):
+            coords, offsets = drop_consecutive_duplicates(*decode_polylines(chunk['POLYLINE']))
+            writer.write(chunk, coords, offsets)
@@ -0,0 +1,204 @@
+import os
+import json
+import sqlite3
+import threading
+import numpy as np
+from collections import defaultdict
+from polylines import decode_int_lists
+
+# Only needed to build ways offline from the network shapefile
+try:
+    import geopandas as gpd
+except ImportError:
+    gpd = None
+
+QUERY_CHUNK = 500  # ids per SQL "IN (...)" query
+
+# Persistent store of OSM way elements as returned by Overpass "out geom"
+# ({'type', 'id', 'tags', 'geometry': [{'lat', 'lon'}, ...]}) in a single SQLite file.
+# Ids Overpass did not return (e.g. deleted ways) are kept as NULL so they are not queried again.
+class WayStore:
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS ways (id INTEGER PRIMARY KEY, way TEXT)')
+        self.db.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM ways').fetchone()[0]
+
+    def _select(self, way_ids):
+        way_ids = [int(wid) for wid in way_ids]
+        rows = {}
+        with self.lock:
+            for start in range(0, len(way_ids), QUERY_CHUNK):
+                chunk = way_ids[start:start + QUERY_CHUNK]
+                query = 'SELECT id, way FROM ways WHERE id IN ({})'.format(','.join('?' * len(chunk)))
+                rows.update(self.db.execute(query, chunk).fetchall())
+        return rows
+
+    # Way ids that are not stored yet
+    def missing(self, way_ids):
+        stored = self._select(way_ids)
+        return [wid for wid in way_ids if int(wid) not in stored]
+
+    # Stored ways in the order of way_ids, ids that are not stored or absent are skipped
+    def get_many(self, way_ids):
+        stored = self._select(way_ids)
+        return [json.loads(stored[int(wid)]) for wid in way_ids if stored.get(int(wid)) is not None]
+
+    def put_many(self, ways):
+        with self.lock:
+            self.db.executemany('INSERT OR REPLACE INTO ways VALUES (?, ?)',
+                                [(way['id'], json.dumps(way)) for way in ways])
+            self.db.commit()
+
+    def put_absent(self, way_ids):
+        with self.lock:
+            self.db.executemany('INSERT OR REPLACE INTO ways VALUES (?, NULL)', [(int(wid),) for wid in way_ids])
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+# Network edges with the CSR table of their OSM way ids (osmnx merges several ways into one
+# edge when simplifying, the ways of edge i are way_ids[way_offsets[i]:way_offsets[i + 1]])
+def read_edges(path='porto/edges.shp'):
+    if gpd is None:
+        raise ImportError('geopandas is required to read the network shapefile')
+    edges = gpd.read_parquet(path) if path.endswith('.parquet') else gpd.read_file(path)
+    column = 'osmid0' if 'osmid0' in edges.columns else 'osmid'
+    way_ids, way_offsets = decode_int_lists(edges[column].astype(str))
+    return edges, way_ids, way_offsets
+
+# Edge rows of every way, with edges present in both directions kept once
+def edges_by_way(edges, way_ids, way_offsets):
+    rows_by_way = defaultdict(list)
+    seen = set()
+    for row, (u, v) in enumerate(zip(edges['u'].tolist(), edges['v'].tolist())):
+        for wid in way_ids[way_offsets[row]:way_offsets[row + 1]].tolist():
+            key = (wid, min(u, v), max(u, v))
+            if key in seen:
+                continue
+            seen.add(key)
+            rows_by_way[wid].append(row)
+    return rows_by_way
+
+# Join the edge geometries of a way into one point sequence by walking from edge to edge
+# through shared nodes, starting at an end of the way (edges are reversed where needed)
+def chain_edges(segments):
+    degree = defaultdict(int)
+    for u, v, _ in segments:
+        degree[u] += 1
+        degree[v] += 1
+    remaining = list(range(len(segments)))
+    points = []
+    node = None
+    while remaining:
+        step = None
+        for i in remaining:
+            u, v, coords = segments[i]
+            if u == node:
+                step = (i, coords, v)
+            elif v == node:
+                step = (i, coords[::-1], u)
+            if step is not None:
+                break
+        if step is None:
+            # continue at an end of the way (or anywhere on a loop) if nothing connects
+            ends = [i for i in remaining if degree[segments[i][0]] == 1] or remaining
+            u, v, coords = segments[ends[0]]
+            step = (ends[0], coords, v)
+            points.extend(coords)
+        else:
+            points.extend(step[1][1:])
+        remaining.remove(step[0])
+        node = step[2]
+    return points
+
+def way_name(edges, rows, way_offsets):
+    single = [row for row in rows if way_offsets[row + 1] - way_offsets[row] == 1]
+    # edges merged from several ways are only used if there is no other, their name may be a list of names
+    names = [name for name in edges['name'].iloc[single or rows].tolist() if isinstance(name, str)]
+    return names[0] if names else None
+
+# Way elements in Overpass "out geom" form built from the local network instead of Overpass.
+# Where osmnx merged several ways into one edge, every one of them gets the full edge geometry.
+def ways_from_edges(path='porto/edges.shp', wanted=None):
+    edges, way_ids, way_offsets = read_edges(path)
+    rows_by_way = edges_by_way(edges, way_ids, way_offsets)
+    if wanted is not None:
+        wanted = set(int(wid) for wid in wanted)
+    ways = []
+    for wid, rows in rows_by_way.items():
+        if wanted is not None and wid not in wanted:
+            continue
+        segments = [(edges['u'].iloc[row], edges['v'].iloc[row], list(edges.geometry.iloc[row].coords)) for row in rows]
+        tags = {}
+        name = way_name(edges, rows, way_offsets)
+        if name is not None:
+            tags['name'] = name
+        ways.append({
+            'type': 'way',
+            'id': wid,
+            'tags': tags,
+            'geometry': [{'lat': lat, 'lon': lon} for lon, lat in chain_edges(segments)],
+        })
+    return ways
+
+# Per-way attribute table built once from the network shapefile and memory-mapped by readers:
+#   way_ids.npy (sorted), length.npy (meters, sum of the osmnx edge lengths),
+#   bbox.npy (min_lon, min_lat, max_lon, max_lat) and name.npy ('' if unnamed)
+def build_way_attributes(path='porto/edges.shp', directory='data/way_attributes'):
+    edges, way_ids, way_offsets = read_edges(path)
+    rows_by_way = edges_by_way(edges, way_ids, way_offsets)
+    wids = np.array(sorted(rows_by_way), dtype=np.int64)
+    edge_lengths = edges['length'].to_numpy(dtype=np.float64)
+    edge_bounds = edges.geometry.bounds.to_numpy(dtype=np.float64)
+
+    lengths = np.zeros(len(wids), dtype=np.float64)
+    bboxes = np.zeros((len(wids), 4), dtype=np.float64)
+    names = []
+    for i, wid in enumerate(wids.tolist()):
+        rows = rows_by_way[wid]
+        lengths[i] = edge_lengths[rows].sum()
+        bounds = edge_bounds[rows]
+        bboxes[i] = bounds[:, 0].min(), bounds[:, 1].min(), bounds[:, 2].max(), bounds[:, 3].max()
+        names.append(way_name(edges, rows, way_offsets) or '')
+
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, 'way_ids.npy'), wids)
+    np.save(os.path.join(directory, 'length.npy'), lengths)
+    np.save(os.path.join(directory, 'bbox.npy'), bboxes)
+    np.save(os.path.join(directory, 'name.npy'), np.array(names, dtype=str))
+
+class WayAttributes:
+    def __init__(self, directory='data/way_attributes'):
+        self.way_ids = np.load(os.path.join(directory, 'way_ids.npy'), mmap_mode='r')
+        self.length = np.load(os.path.join(directory, 'length.npy'), mmap_mode='r')
+        self.bbox = np.load(os.path.join(directory, 'bbox.npy'), mmap_mode='r')
+        self.name = np.load(os.path.join(directory, 'name.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.way_ids)
+
+    # Rows of the given way ids, -1 for ways that are not in the network
+    def rows_of(self, wids):
+        wids = np.asarray(wids, dtype=np.int64)
+        rows = np.searchsorted(self.way_ids, wids)
+        found = rows < len(self.way_ids)
+        found[found] = self.way_ids[rows[found]] == wids[found]
+        return np.where(found, rows, -1)
+
+    # Length in meters of the given way ids, 0 for ways that are not in the network
+    def length_of(self, wids):
+        rows = self.rows_of(wids)
+        lengths = np.zeros(len(rows), dtype=np.float64)
+        lengths[rows >= 0] = self.length[rows[rows >= 0]]
+        return lengths